@@ -0,0 +1,62 @@
+"""Offline benchmarks for the bot's hot paths.
+
+Moodle, weblogin and the staff pages are served from benchmarks/fixtures
+by a local aiohttp server, Discord is replaced by fake guilds and channels
+and the database by an in-memory implementation of the Database API.
+
+Run from the repository root:
+
+    python -m benchmarks                       # every benchmark
+    python -m benchmarks get_news deadchannels # just these
+    python -m benchmarks --json before.json    # save results
+    python -m benchmarks --compare before.json # show the change against them
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+
+from . import cases  # registers the benchmarks
+from .harness import CASES, load, report, run_case, save
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("cases", nargs="*", help="benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--posts", type=int, default=10, help="posts per forum")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=2000, help="rows per scan")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.001,
+        help="seconds each fake Discord API call takes",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="compare against results from --json")
+    return parser.parse_args()
+
+
+async def main(options):
+    names = options.cases or list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        raise SystemExit(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    results = []
+    for name in names:
+        results.append(await run_case(name, options))
+
+    report(results, load(options.compare) if options.compare else None)
+    if options.json:
+        save(results, options.json)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    # The cogs read data/ relative to the repository root.
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    asyncio.get_event_loop().run_until_complete(main(parse_args()))
@@ -0,0 +1,305 @@
+import datetime
+import itertools
+import json
+import os
+import sys
+import tempfile
+
+from cogs.general import General
+from cogs.lancaster import Lancaster
+from cogs.utils.db.database import DBFilter
+from cogs.utils.db.models import MODELS
+from cogs.utils.http import HostPolicy
+from cogs.utils.metrics import collect_stages
+
+from .fakes import FakeBot, FakeContext, FakeGuild, MemoryDatabase
+from .harness import Prepared, benchmark
+from .moodle import MoodleStandIn
+
+
+def rss_forums_file():
+    """A copy of data/forums.json with a feed for every forum."""
+    with open(os.path.join("data", "forums.json")) as f:
+        forums = json.load(f)
+    for forum in forums:
+        forum["rss"] = (
+            f"/rss/file.php/{forum['id']}/{{token}}/mod_forum/{forum['id']}/rss.xml"
+        )
+    fd, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(forums, f)
+    return path
+
+
+async def lancaster_cog(options, guilds=(), rss=False):
+    """A Lancaster cog pointed at a local Moodle stand-in, reading forum
+    feeds rather than pages if 'rss' is set."""
+    moodle = MoodleStandIn(posts=options.posts)
+    await moodle.start()
+
+    database = MemoryDatabase()
+    bot = FakeBot(database, guilds)
+    cog = Lancaster(bot)
+    cog.weblogin_url = cog.moodle_url = cog.staff_url = moodle.url
+    if rss:
+        cog.forums_file = rss_forums_file()
+    await cog.setup()
+    # Benchmarks drive the checks themselves.
+    cog.check_for_announcements_task.cancel()
+    # Measure the code rather than the rate limits.
+    unlimited = HostPolicy(rate=1e9, burst=1e9, concurrency=1000)
+    bot.web.configure(moodle.url, unlimited)
+
+    async def cleanup():
+        cog.delivery_pool.cancel()
+        await bot.web.close()
+        Lancaster.login_to_portal.cache_clear()
+        Lancaster.get_profile_picture.cache_clear()
+        Lancaster.get_extra_details.cache_clear()
+        await moodle.close()
+        if rss:
+            os.remove(cog.forums_file)
+
+    return cog, moodle, cleanup
+
+
+@benchmark("dbfilter_sql", number=10000)
+async def dbfilter_sql(options):
+    async def op():
+        DBFilter(guild_id=1234, key="announcement_channel").sql()
+        DBFilter(guild_id=1234, post_id__in=[str(n) for n in range(20)]).sql()
+
+    return Prepared(op)
+
+
+@benchmark("get_news")
+async def get_news(options, rss=False):
+    cog, moodle, cleanup = await lancaster_cog(options, rss=rss)
+    last_run = {}
+
+    async def op():
+        # Read every feed in full rather than getting a 304.
+        cog.feed_modified.clear()
+        moodle.requests = moodle.bytes_sent = 0
+        with collect_stages() as stages:
+            await cog.get_news()
+        last_run.update(stages)
+
+    def extra():
+        return {
+            "requests_per_run": moodle.requests,
+            "bytes_per_run": moodle.bytes_sent,
+            "parse_ms": round(last_run.get("parse", 0) * 1000, 2),
+        }
+
+    return Prepared(op, cleanup, extra)
+
+
+@benchmark("get_news_rss")
+async def get_news_rss(options):
+    """get_news reading forum feeds, which include each post's body."""
+    return await get_news(options, rss=True)
+
+
+@benchmark("get_extra_details", number=20)
+async def get_extra_details(options):
+    cog, moodle, cleanup = await lancaster_cog(options)
+    # A new post each time, so the cache never answers.
+    post_ids = itertools.count(1)
+
+    async def op():
+        await cog.get_extra_details(str(next(post_ids)))
+
+    return Prepared(op, cleanup)
+
+
+async def announcement_guilds(options, database):
+    guilds = [
+        FakeGuild(n, channels=1, latency=options.latency)
+        for n in range(1, options.guilds + 1)
+    ]
+    for guild in guilds:
+        await database.set_setting(guild, "announcement_channel", guild.channels[0].id)
+    return guilds
+
+
+@benchmark("check_for_announcements")
+async def check_for_announcements(options, digest=False):
+    """A poll where every post is new to every guild."""
+    cog, moodle, cleanup = await lancaster_cog(options)
+    database = cog.bot.database
+    cog.bot.guilds = await announcement_guilds(options, database)
+    if digest:
+        for guild in cog.bot.guilds:
+            await database.set_setting(guild, "announcement_digest", True)
+
+    async def op():
+        for name, records in database.tables.items():
+            if name != database.settings_table:
+                records.clear()
+        for guild in cog.bot.guilds:
+            guild.channels[0].sent.clear()
+        Lancaster.get_extra_details.cache_clear()
+        database.queries = 0
+        await cog.check_for_announcements()
+        await cog.delivery_pool.join()
+
+    def extra():
+        sent = sum(len(g.channels[0].sent) for g in cog.bot.guilds)
+        return {
+            "guilds": len(cog.bot.guilds),
+            "posts": options.posts,
+            "queries_per_run": database.queries,
+            "messages": sent,
+        }
+
+    return Prepared(op, cleanup, extra)
+
+
+@benchmark("check_for_announcements_digest")
+async def check_for_announcements_digest(options):
+    """The same poll, with every guild in digest mode."""
+    return await check_for_announcements(options, digest=True)
+
+
+@benchmark("check_for_announcements_idle")
+async def check_for_announcements_idle(options, rss=False):
+    """A poll where nothing has changed, which is what most polls are."""
+    cog, moodle, cleanup = await lancaster_cog(options, rss=rss)
+    database = cog.bot.database
+    cog.bot.guilds = await announcement_guilds(options, database)
+    await cog.check_for_announcements()
+    await cog.delivery_pool.join()
+
+    async def op():
+        database.queries = 0
+        moodle.requests = moodle.bytes_sent = 0
+        cog.stage_duration.series.clear()
+        await cog.check_for_announcements()
+        await cog.delivery_pool.join()
+
+    def extra():
+        stages = {
+            labels["stage"]: mean
+            for labels, _, mean, _, _ in cog.stage_duration.summary()
+        }
+        return {
+            "queries_per_run": database.queries,
+            "requests_per_run": moodle.requests,
+            "bytes_per_run": moodle.bytes_sent,
+            "parse_ms": round(stages.get("parse", 0) * 1000, 2),
+        }
+
+    return Prepared(op, cleanup, extra)
+
+
+def moodle_post_rows(rows, search):
+    """Rows shaped like moodle_post, each with its own strings the way a
+    fetch allocates them, optionally with the search tsvector."""
+    date = datetime.datetime(2021, 1, 1)
+    words = "the lecture on friday is moved to the main hall please bring".split()
+    for n in range(rows):
+        description = " ".join(f"{word}{n}" for word in words * 12)
+        row = (
+            n,
+            str(n),
+            "CS Announcements",
+            f"Lecture {n} moved",
+            "A Lecturer",
+            "https://example.com/avatar.png",
+            f"https://modules.lancaster.ac.uk/mod/forum/discuss.php?d={n}",
+            date,
+            date,
+            description,
+            date,
+        )
+        if search:
+            tsvector = " ".join(f"'{word}{n}':{i}C" for i, word in enumerate(words))
+            row += (tsvector,)
+        yield row
+
+
+def size_of(objects, values):
+    """The bytes held by a list of 'objects' and the 'values' of each, with
+    shared values counted once. tracemalloc undercounts records, asyncpg
+    reuses freed ones from a freelist it can't see."""
+    seen = set()
+    total = sys.getsizeof(objects)
+    for obj in objects:
+        total += sys.getsizeof(obj)
+        for value in values(obj):
+            if id(value) not in seen:
+                seen.add(id(value))
+                total += sys.getsizeof(value)
+    return total
+
+
+@benchmark("record_memory", number=1)
+async def record_memory(options):
+    """Memory held by a large scan of moodle_post. Without a model DBQuery
+    selected every column into asyncpg records, with one it selects just
+    the model's columns into slotted instances. Records of the same columns
+    show how much of the difference is the model and how much the column
+    it leaves out."""
+    # asyncpg's own helper for building records without a connection.
+    from asyncpg.protocol.protocol import _create_record
+
+    model = MODELS["moodle_post"]
+    names = [column.name for column in model.columns]
+    columns = {name: n for n, name in enumerate(names)}
+    all_columns = {name: n for n, name in enumerate(names + ["search"])}
+    results = {}
+
+    def slots(record):
+        return [column.slot.__get__(record) for column in model.columns]
+
+    async def op():
+        results["records"] = size_of(
+            [
+                _create_record(all_columns, row)
+                for row in moodle_post_rows(options.rows, search=True)
+            ],
+            tuple,
+        )
+        results["records_same_columns"] = size_of(
+            [
+                _create_record(columns, row)
+                for row in moodle_post_rows(options.rows, search=False)
+            ],
+            tuple,
+        )
+        results["models"] = size_of(
+            [model(*row) for row in moodle_post_rows(options.rows, False)], slots
+        )
+
+    def extra():
+        per_row = {k: v // options.rows for k, v in results.items()}
+        return {
+            "rows": options.rows,
+            **{f"{k}_bytes_per_row": v for k, v in per_row.items()},
+            "model_vs_same_columns": (
+                f"{results['models'] / results['records_same_columns'] - 1:+.1%}"
+            ),
+            "saving": f"{1 - results['models'] / results['records']:.0%}",
+        }
+
+    return Prepared(op, extra=extra)
+
+
+@benchmark("check_for_announcements_idle_rss")
+async def check_for_announcements_idle_rss(options):
+    """The idle poll reading forum feeds, which stop at the first seen post."""
+    return await check_for_announcements_idle(options, rss=True)
+
+
+@benchmark("deadchannels")
+async def deadchannels(options):
+    guild = FakeGuild(1, channels=options.channels, latency=options.latency)
+    bot = FakeBot(MemoryDatabase(), [guild])
+    cog = General(bot)
+    ctx = FakeContext(bot, guild, latency=options.latency)
+
+    async def op():
+        await cog.deadchannels.callback(cog, ctx, 10)
+
+    return Prepared(op)
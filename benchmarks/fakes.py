@@ -0,0 +1,403 @@
+"""In-process stand-ins for Discord and the database, just enough of each
+for the cogs to run against them."""
+
+import asyncio
+import datetime
+import itertools
+import operator
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+import discord
+
+from cogs.utils.db import Database
+from cogs.utils.db.models import MODELS
+from cogs.utils.http import PoliteClient
+from cogs.utils.metrics import Registry
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embed=None, created_at=None):
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.created_at = created_at or datetime.datetime.utcnow()
+
+    async def edit(self, content=None, embed=None):
+        await asyncio.sleep(self.channel.latency)
+        self.content = content or self.content
+        self.embed = embed or self.embed
+
+
+class FakeHistory:
+    def __init__(self, messages, latency):
+        self.messages = messages
+        self.latency = latency
+
+    async def flatten(self):
+        await asyncio.sleep(self.latency)
+        return self.messages
+
+
+class FakeHTTP:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def request(self, route, json=None):
+        await asyncio.sleep(self.channel.latency)
+        return json
+
+
+class FakeState:
+    """Stands in for the connection state, for code that calls Discord's
+    HTTP API directly."""
+
+    def __init__(self, channel):
+        self.http = FakeHTTP(channel)
+
+    def create_message(self, channel, data):
+        message = FakeMessage(channel, data.get("content"), data.get("embeds"))
+        channel.sent.append(message)
+        return message
+
+
+class FakeChannel(discord.TextChannel):
+    """A text channel which records what is sent to it, every API call
+    takes 'latency' seconds."""
+
+    def __init__(self, id, guild, latency=0.0, last_message_at=None):
+        self.id = id
+        self.name = f"channel-{id}"
+        self.guild = guild
+        self.latency = latency
+        self.sent = []
+        self.last_message_at = last_message_at
+        self._state = FakeState(self)
+
+    def __repr__(self):
+        return f"<FakeChannel id={self.id}>"
+
+    async def send(self, content=None, *, embed=None, file=None):
+        await asyncio.sleep(self.latency)
+        message = FakeMessage(self, content, embed)
+        self.sent.append(message)
+        return message
+
+    def history(self, limit=100):
+        messages = []
+        if self.last_message_at is not None:
+            messages.append(FakeMessage(self, created_at=self.last_message_at))
+        return FakeHistory(messages[:limit], self.latency)
+
+
+class FakeGuild:
+    def __init__(self, id, channels=0, latency=0.0):
+        self.id = id
+        self.name = f"guild-{id}"
+        start = datetime.datetime(2021, 1, 1)
+        self.channels = [
+            FakeChannel(
+                id * 1000 + n,
+                self,
+                latency,
+                last_message_at=start + datetime.timedelta(hours=n),
+            )
+            for n in range(channels)
+        ]
+
+    def get_channel(self, channel_id):
+        for channel in self.channels:
+            if channel.id == channel_id:
+                return channel
+
+    def get_role(self, role_id):
+        return None
+
+
+class FakeContext:
+    def __init__(self, bot, guild, latency=0.0):
+        self.bot = bot
+        self.guild = guild
+        self.channel = FakeChannel(0, guild, latency)
+
+    async def send(self, content=None, *, embed=None, file=None):
+        return await self.channel.send(content, embed=embed, file=file)
+
+
+class FakeBot:
+    def __init__(self, database, guilds=()):
+        self.database = database
+        self.metrics = Registry()
+        self.web = PoliteClient(self.metrics)
+        self.login_data = ("bench", "bench")
+        self.rss_token = "bench"
+        self.guilds = list(guilds)
+        self.command_prefix = "!"
+        self.loop = asyncio.get_event_loop()
+
+    def is_ready(self):
+        return False
+
+    def remove_command(self, name):
+        pass
+
+
+OPERATORS = {
+    "gt": operator.gt,
+    "ge": operator.ge,
+    "lt": operator.lt,
+    "le": operator.le,
+    "ne": operator.ne,
+    "in": lambda value, options: value in options,
+}
+
+
+def matches(record, where):
+    """Evaluate a DBFilter the way DBFilter.sql does, conditions on the same
+    field are OR'd and different fields are AND'd."""
+    if where is None:
+        return True
+    conditions = defaultdict(list)
+    for key, value in where.filter_kwargs.items():
+        field, _, op = key.rpartition("__")
+        if field and op in OPERATORS:
+            conditions[field].append((OPERATORS[op], value))
+        else:
+            conditions[key].append((operator.eq, value))
+    return all(
+        any(compare(op, record.get(field), value) for op, value in checks)
+        for field, checks in conditions.items()
+    )
+
+
+def compare(op, field_value, value):
+    # Mirrors SQL, where None means NULL and comparisons with NULL are false.
+    if value is None:
+        if op is operator.eq:
+            return field_value is None
+        return field_value is not None
+    if field_value is None:
+        return False
+    return op(field_value, value)
+
+
+class MemoryTable:
+    """Implements the DBQuery API over a list of dicts, returning models
+    like DBQuery does."""
+
+    def __init__(self, database, name, model=None):
+        self.database = database
+        self.name = name
+        self.model = model
+        self.records = database.tables[name]
+
+    def _sorted(self, records, limit, order_by, desc):
+        if order_by is not None:
+            records = sorted(records, key=lambda r: r[order_by], reverse=desc)
+        records = list(records)[:limit]
+        if self.model is None:
+            return records
+        return [self.model.from_mapping(record) for record in records]
+
+    async def all(self, limit=None, order_by=None, desc=False):
+        self.database.queries += 1
+        return self._sorted(self.records, limit, order_by, desc)
+
+    async def filter(self, where, limit=None, order_by=None, desc=False):
+        self.database.queries += 1
+        records = [r for r in self.records if matches(r, where)]
+        return self._sorted(records, limit, order_by, desc)
+
+    async def new_record(self, **kwargs):
+        await self.new_record_with_id(**kwargs)
+
+    async def new_record_with_id(self, **kwargs):
+        self.database.queries += 1
+        record = {"id": next(self.database.ids), **kwargs}
+        self.records.append(record)
+        return record["id"]
+
+    async def new_record_if_absent(self, **kwargs):
+        unique = self.database.unique.get(self.name, ())
+        for record in self.records:
+            if unique and all(record.get(k) == kwargs.get(k) for k in unique):
+                self.database.queries += 1
+                return False
+        await self.new_record_with_id(**kwargs)
+        return True
+
+    async def update_records(self, where=None, **kwargs):
+        self.database.queries += 1
+        for record in self.records:
+            if matches(record, where):
+                record.update(kwargs)
+
+    async def delete_records(self, *, where=None):
+        self.database.queries += 1
+        self.records[:] = [r for r in self.records if not matches(r, where)]
+
+
+class MemoryLock:
+    held = True
+
+    async def acquire(self):
+        return True
+
+    async def release(self):
+        pass
+
+
+class MemoryListener:
+    async def close(self):
+        pass
+
+
+class MemoryBatch:
+    def __init__(self, outbox, jobs):
+        self.outbox = outbox
+        self.jobs = jobs
+
+    @property
+    def guild_id(self):
+        return self.jobs[0]["guild_id"]
+
+    async def complete(self):
+        self.outbox.database.queries += 1
+        log = self.outbox.database.table(self.outbox.log)
+        for job in self.jobs:
+            job["status"] = "done"
+            await log.new_record_if_absent(
+                guild_id=job["guild_id"], post_id=job["post_id"]
+            )
+
+    async def fail(self, error):
+        self.outbox.database.queries += 1
+        for job in self.jobs:
+            job["attempts"] += 1
+            job["last_error"] = str(error)
+            if job["attempts"] >= self.outbox.max_attempts:
+                job["status"] = "dead"
+            job["available_at"] = datetime.datetime.utcnow() + datetime.timedelta(
+                seconds=self.outbox.backoff * 2 ** (job["attempts"] - 1)
+            )
+
+
+class MemoryOutbox:
+    """Implements the Outbox API over a list of dicts, guilds with a batch
+    in flight are skipped by other claims the way locked ones are."""
+
+    def __init__(self, database, name, log, max_attempts=5, backoff=30):
+        self.database = database
+        self.name = name
+        self.log = log
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.records = database.tables[name]
+        self.locked = set()
+
+    def due(self, guild_ids):
+        now = datetime.datetime.utcnow()
+        return [
+            job
+            for job in self.records
+            if job["status"] == "pending"
+            and job["available_at"] <= now
+            and job["guild_id"] in guild_ids
+        ]
+
+    async def enqueue(self, jobs):
+        self.database.queries += 1
+        queued = {(job["guild_id"], job["post_id"]) for job in self.records}
+        for job in jobs:
+            if (job["guild_id"], job["post_id"]) not in queued:
+                self.records.append(
+                    {
+                        "id": next(self.database.ids),
+                        "guild_id": job["guild_id"],
+                        "post_id": job["post_id"],
+                        "status": "pending",
+                        "attempts": 0,
+                        "available_at": datetime.datetime.utcnow(),
+                        "last_error": None,
+                    }
+                )
+
+    @asynccontextmanager
+    async def claim(self, guild_ids, batch_size=None):
+        self.database.queries += 1
+        locked = []
+        jobs = []
+        for guild_id in dict.fromkeys(job["guild_id"] for job in self.due(guild_ids)):
+            if guild_id in self.locked:
+                continue
+            self.locked.add(guild_id)
+            locked.append(guild_id)
+            limit = await batch_size(guild_id) if batch_size else 1
+            jobs = self.due([guild_id])[:limit]
+            if jobs:
+                break
+
+        batch = MemoryBatch(self, jobs)
+        try:
+            yield batch
+        except Exception as e:
+            if not batch.jobs:
+                raise
+            await batch.fail(e)
+            raise
+        finally:
+            self.locked.difference_update(locked)
+
+    async def next_available(self, guild_ids):
+        self.database.queries += 1
+        pending = [
+            job["available_at"]
+            for job in self.records
+            if job["status"] == "pending" and job["guild_id"] in guild_ids
+        ]
+        return min(pending, default=None)
+
+    async def counts(self):
+        counts = defaultdict(int)
+        for job in self.records:
+            counts[job["status"]] += 1
+        return dict(counts)
+
+
+class MemoryDatabase(Database):
+    """The Database API kept in memory, counting the queries made so that
+    benchmarks can report them."""
+
+    unique = {
+        "moodle_post": ("post_id",),
+        "demographics_roles": ("guild_id", "post_id"),
+        "moodle_event": ("uid",),
+        "event_reminder": ("guild_id", "uid", "reminder", "due_at"),
+    }
+
+    def __init__(self):
+        super().__init__("memory://")
+        self.tables = defaultdict(list)
+        self.ids = itertools.count(1)
+        self.queries = 0
+
+    async def connect(self):
+        pass
+
+    def connection(self):
+        raise NotImplementedError("MemoryDatabase has no SQL connection.")
+
+    async def listen(self, channel, callback):
+        return MemoryListener()
+
+    async def notify(self, channel, payload=""):
+        pass
+
+    def advisory_lock(self, key):
+        return MemoryLock()
+
+    def outbox(self, name, log, **kwargs):
+        return MemoryOutbox(self, name, log, **kwargs)
+
+    def table(self, name):
+        return MemoryTable(self, name, MODELS.get(name))
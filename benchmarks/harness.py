@@ -0,0 +1,99 @@
+import json
+import statistics
+import time
+
+CASES = {}
+
+
+class Prepared:
+    """What a benchmark's setup returns: 'op' is the coroutine function that
+    is timed, 'cleanup' runs afterwards and 'extra' returns a dict of
+    anything else worth reporting, like query counts."""
+
+    def __init__(self, op, cleanup=None, extra=None):
+        self.op = op
+        self.cleanup = cleanup
+        self.extra = extra
+
+
+def benchmark(name, number=1):
+    """Register an async benchmark setup function, which gets the command
+    line options and returns a Prepared. Its op is timed 'number' times
+    per repeat."""
+
+    def decorator(func):
+        CASES[name] = (func, number)
+        return func
+
+    return decorator
+
+
+async def run_case(name, options):
+    func, number = CASES[name]
+    prepared = await func(options)
+
+    try:
+        await prepared.op()  # warm up
+        timings = []
+        for _ in range(options.repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                await prepared.op()
+            timings.append((time.perf_counter() - start) / number)
+    finally:
+        if prepared.cleanup is not None:
+            await prepared.cleanup()
+
+    result = {
+        "name": name,
+        "number": number,
+        "repeat": options.repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+    }
+    if prepared.extra is not None:
+        result.update(prepared.extra())
+    return result
+
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.3f}s"
+
+
+def report(results, baseline=None):
+    baseline = {r["name"]: r for r in baseline or []}
+    width = max([len(r["name"]) for r in results] + [4])
+    print(f"{'case':<{width}}  {'min':>10}  {'median':>10}  {'mean':>10}  change")
+    for result in results:
+        line = (
+            f"{result['name']:<{width}}  {format_seconds(result['min']):>10}"
+            f"  {format_seconds(result['median']):>10}"
+            f"  {format_seconds(result['mean']):>10}"
+        )
+        if result["name"] in baseline:
+            before = baseline[result["name"]]["median"]
+            line += f"  {(result['median'] - before) / before * 100:+.1f}%"
+        print(line)
+
+        extra = {
+            k: v
+            for k, v in result.items()
+            if k not in ("name", "number", "repeat", "min", "median", "mean")
+        }
+        if extra:
+            print(" " * (width + 2) + ", ".join(f"{k}={v}" for k, v in extra.items()))
+
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
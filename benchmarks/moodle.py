@@ -0,0 +1,151 @@
+"""A local stand-in for weblogin, Moodle and the staff pages, serving the
+pages and feeds in benchmarks/fixtures so the scraper can run without the
+network."""
+
+import datetime
+import os
+from string import Template
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+AUTHORS = ("Jane Smith", "Barry Porter", "Amit Chopra", "Sarah Clinch")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return Template(f.read())
+
+
+class MoodleStandIn:
+    """Serves 'posts' discussions on every forum, post ids are derived from
+    the forum id so that they are unique across forums."""
+
+    def __init__(self, posts=10):
+        self.posts = posts
+        self.requests = 0
+        self.bytes_sent = 0
+        self.url = None
+        self.runner = None
+        self.pages = {
+            name: load_fixture(name + ".html")
+            for name in (
+                "login",
+                "logged_in",
+                "forum",
+                "forum_row",
+                "discussion",
+                "staff",
+            )
+        }
+        self.pages["rss"] = load_fixture("rss.xml")
+        self.pages["rss_item"] = load_fixture("rss_item.xml")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/login/", self.login)
+        app.router.add_get("/mod/forum/view.php", self.forum)
+        app.router.add_get("/mod/forum/discuss.php", self.discussion)
+        app.router.add_get(
+            "/rss/file.php/{context}/{token}/mod_forum/{forum}/rss.xml", self.feed
+        )
+        app.router.add_get("/scc/about-us/people/{slug}", self.staff)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def close(self):
+        await self.runner.cleanup()
+
+    def render(self, page, content_type="text/html", **kwargs):
+        text = self.pages[page].safe_substitute(moodle=self.url, **kwargs)
+        self.requests += 1
+        self.bytes_sent += len(text)
+        return web.Response(text=text, content_type=content_type)
+
+    async def login(self, request):
+        if request.method == "GET":
+            fields = '<input type="text" name="username" value="">'
+            return self.render("login", stage="username", fields=fields)
+
+        data = await request.post()
+        if "password" in data:
+            return self.render("logged_in")
+        fields = (
+            f'<input type="hidden" name="username" value="{data["username"]}">'
+            '<input type="password" name="password" value="">'
+        )
+        return self.render("login", stage="password", fields=fields)
+
+    def post_ids(self, forum):
+        return [forum * 1000 + n for n in range(self.posts)]
+
+    async def forum(self, request):
+        forum = int(request.query["id"])
+        start = datetime.date(2021, 5, 28)
+        rows = "\n".join(
+            [
+                self.pages["forum_row"].safe_substitute(
+                    moodle=self.url,
+                    forum=forum,
+                    id=post_id,
+                    title=f"Announcement {post_id}",
+                    author=AUTHORS[n % len(AUTHORS)],
+                    date=(start - datetime.timedelta(days=n)).strftime("%d %b %Y"),
+                )
+                for n, post_id in enumerate(self.post_ids(forum))
+            ]
+        )
+        return self.render("forum", forum=forum, name=f"Forum {forum}", rows=rows)
+
+    async def feed(self, request):
+        # The feeds never change, so a conditional request always gets a 304.
+        modified = "Fri, 28 May 2021 09:15:00 GMT"
+        if request.headers.get("If-Modified-Since") == modified:
+            self.requests += 1
+            return web.Response(status=304)
+
+        forum = int(request.match_info["forum"])
+        start = datetime.datetime(2021, 5, 28, 9, 15)
+        items = "\n".join(
+            [
+                self.pages["rss_item"].safe_substitute(
+                    moodle=self.url,
+                    id=post_id,
+                    title=f"Announcement {post_id}",
+                    author=AUTHORS[n % len(AUTHORS)],
+                    date=(start - datetime.timedelta(days=n)).strftime(
+                        "%a, %d %b %Y %H:%M:%S GMT"
+                    ),
+                )
+                for n, post_id in enumerate(self.post_ids(forum))
+            ]
+        )
+        response = self.render(
+            "rss",
+            content_type="application/rss+xml",
+            forum=forum,
+            name=f"Forum {forum}",
+            items=items,
+        )
+        response.headers["Last-Modified"] = modified
+        return response
+
+    async def discussion(self, request):
+        post_id = request.query["d"]
+        return self.render(
+            "discussion",
+            id=post_id,
+            title=f"Announcement {post_id}",
+            author=AUTHORS[0],
+            datetime="2021-05-04T10:15:00+01:00",
+        )
+
+    async def staff(self, request):
+        slug = request.match_info["slug"]
+        name = " ".join([part.capitalize() for part in slug.split("-")])
+        return self.render("staff", slug=slug, name=name)
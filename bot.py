@@ -1,29 +1,138 @@
+import time
+
+STARTED_AT = time.perf_counter()
+
+import asyncio
 import logging
 import os
 import sys
 import configparser
 
+import discord
 from discord.ext import commands
 
+from cogs.base import BaseCog
 from cogs.utils.db import Database
-from cogs.utils.db.fields import *
+from cogs.utils.http import PoliteClient
+from cogs.utils.metrics import Registry
+from cogs.utils.timing import PhaseTimer
+from cogs.utils.watchdog import LoopLagMonitor
 
 
-class LancasterUniBot(commands.Bot):
-    def __init__(self, prefix, database_url, login_data):
-        super().__init__(command_prefix=prefix)
+class LancasterUniBot(commands.AutoShardedBot):
+    def __init__(
+        self,
+        prefix,
+        database_url,
+        login_data,
+        metrics_port=None,
+        shard_ids=None,
+        shard_count=None,
+        rss_token=None,
+        calendar_url=None,
+        members_intent=False,
+        max_messages=1000,
+    ):
+        self.startup = PhaseTimer(start=STARTED_AT)
+        self.startup.mark("imports")
+        # Only userinfo needs members and it fetches them when asked, so by
+        # default no members are received, cached or chunked at startup,
+        # which keeps memory flat however big the guilds are.
+        intents = discord.Intents.default()
+        intents.members = members_intent
+        intents.typing = False
+        # With no shard settings discord.py picks the shard count itself and
+        # runs every shard in this process. Give each process its own
+        # shard_ids to split the bot over several processes.
+        super().__init__(
+            command_prefix=prefix,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+            intents=intents,
+            member_cache_flags=discord.MemberCacheFlags.from_intents(intents),
+            chunk_guilds_at_startup=False,
+            max_messages=max_messages,
+        )
         self.login_data = login_data
+        self.rss_token = rss_token
+        self.calendar_url = calendar_url
         self.database_url = database_url
         self.database = Database(self.database_url, ssl=True)
+        self.metrics = Registry()
+        self.metrics_port = metrics_port
+        self.web = PoliteClient(self.metrics)
+        self.command_latency = self.metrics.histogram(
+            "command_duration_seconds",
+            "Time from receiving a command message to finishing it.",
+            ("command", "status"),
+        )
+        self.lag_monitor = LoopLagMonitor(
+            histogram=self.metrics.histogram(
+                "event_loop_lag_seconds",
+                "How late the event loop woke up from a sleep.",
+            )
+        )
         self.load_extension("cogs.general")
         self.load_extension("cogs.lancaster")
+        self.load_extension("cogs.deadlines")
         self.load_extension("cogs.monke")
+        self.load_extension("cogs.diagnostics")
         self.logger = logging.getLogger(__name__)
+        self.startup.mark("extensions")
 
-    async def on_connect(self):
+    async def start(self, *args, **kwargs):
+        self.lag_monitor.start(self.loop)
+        # Migrate here rather than in on_connect, which runs again after
+        # every gateway reconnect.
         await self.database.connect()
+        self.startup.mark("migrations")
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        self.lag_monitor.stop()
+        await self.web.close()
+        await super().close()
+
+    async def get_context(self, message, *, cls=commands.Context):
+        ctx = await super().get_context(message, cls=cls)
+        ctx.received_at = time.perf_counter()
+        return ctx
+
+    def observe_command(self, ctx, status):
+        """Record how long a command took, from its message arriving."""
+        if ctx.command is not None and hasattr(ctx, "received_at"):
+            self.command_latency.observe(
+                time.perf_counter() - ctx.received_at,
+                command=ctx.command.qualified_name,
+                status=status,
+            )
+
+    async def on_command_completion(self, ctx):
+        self.observe_command(ctx, "ok")
+
+    async def setup_cogs(self):
+        """Run the setup of every cog concurrently."""
+        cogs = [cog for cog in self.cogs.values() if isinstance(cog, BaseCog)]
+        results = await asyncio.gather(
+            *[cog._setup() for cog in cogs], return_exceptions=True
+        )
+        for cog, result in zip(cogs, results):
+            if isinstance(result, Exception):
+                self.logger.error(
+                    f"Setting up {cog.qualified_name} failed, it will be tried "
+                    "again on the next reconnect.",
+                    exc_info=result,
+                )
 
     async def on_ready(self):
+        first_ready = "gateway" not in self.startup.phases
+        if first_ready:
+            self.startup.mark("gateway")
+        await self.setup_cogs()
+        if first_ready:
+            self.startup.mark("cog setup")
+            self.logger.info(f"Ready in {self.startup.summary()}")
+
         self.logger.info("Bot is ready and accepting commands.")
         self.logger.info(
             f"Invite link: https://discord.com/oauth2/authorize?client_id={self.user.id}&permissions=8&scope=bot"
@@ -38,6 +147,13 @@ def generate_settings():
         "prefix": "",
         "portal_username": "",
         "portal_password": "",
+        "metrics_port": "",
+        "shard_ids": "",
+        "shard_count": "",
+        "rss_token": "",
+        "calendar_url": "",
+        "members_intent": "",
+        "max_messages": "",
     }
     with open("settings.cfg", "w") as f:
         config.write(f)
@@ -53,6 +169,13 @@ if __name__ == "__main__":
         database_url = os.environ["DATABASE_URL"]
         prefix = os.environ["PREFIX"]
         login_data = (os.environ["PORTAL_USERNAME"], os.environ["PORTAL_PASSWORD"])
+        metrics_port = os.environ.get("METRICS_PORT")
+        shard_ids = os.environ.get("SHARD_IDS")
+        shard_count = os.environ.get("SHARD_COUNT")
+        rss_token = os.environ.get("RSS_TOKEN")
+        calendar_url = os.environ.get("CALENDAR_URL")
+        members_intent = os.environ.get("MEMBERS_INTENT")
+        max_messages = os.environ.get("MAX_MESSAGES")
     except KeyError:
 
         if not os.path.exists("settings.cfg"):
@@ -74,11 +197,30 @@ if __name__ == "__main__":
                 config["BotSettings"]["portal_username"],
                 config["BotSettings"]["portal_password"],
             )
+            metrics_port = config["BotSettings"].get("metrics_port")
+            shard_ids = config["BotSettings"].get("shard_ids")
+            shard_count = config["BotSettings"].get("shard_count")
+            rss_token = config["BotSettings"].get("rss_token")
+            calendar_url = config["BotSettings"].get("calendar_url")
+            members_intent = config["BotSettings"].get("members_intent")
+            max_messages = config["BotSettings"].get("max_messages")
         except (configparser.NoSectionError, KeyError):
             logging.critical(
                 "Malformed 'settings.cfg' file, please fix this before running the bot."
             )
             sys.exit()
 
-    bot = LancasterUniBot(prefix, database_url, login_data)
+    bot = LancasterUniBot(
+        prefix,
+        database_url,
+        login_data,
+        metrics_port=int(metrics_port) if metrics_port else None,
+        shard_ids=[int(i) for i in shard_ids.split(",")] if shard_ids else None,
+        shard_count=int(shard_count) if shard_count else None,
+        rss_token=rss_token or None,
+        calendar_url=calendar_url or None,
+        members_intent=(members_intent or "").lower() in ("1", "true", "yes"),
+        # 0 turns the message cache off, discord.py wants None for that.
+        max_messages=(int(max_messages) or None) if max_messages else 1000,
+    )
     bot.run(token)
@@ -6,13 +6,28 @@ class BaseCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.emoji = ""
+        self.is_setup = False
+        self._setup_lock = asyncio.Lock()
 
-        loop = asyncio.get_event_loop()
-        loop.create_task(self._setup())
+        # The bot sets up every cog together once it is ready, a cog
+        # (re)loaded after that point has to set itself up.
+        if bot.is_ready():
+            loop = asyncio.get_event_loop()
+            loop.create_task(self._setup())
 
     async def _setup(self):
-        await self.bot.wait_until_ready()
-        await self.setup()
+        # is_setup is only set once setup() has finished, so one that fails
+        # is tried again on the next on_ready, and cog_unload can tell
+        # whether there is anything to tear down.
+        async with self._setup_lock:
+            if not self.is_setup:
+                await self.setup()
+                self.is_setup = True
 
     async def setup(self):
-        pass
\ No newline at end of file
+        pass
+
+    def cache_sizes(self):
+        """The sizes of anything this cog keeps in memory, by name, for the
+        memory command."""
+        return {}
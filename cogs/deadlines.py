@@ -0,0 +1,232 @@
+import asyncio
+import datetime
+import logging
+
+import discord
+from discord.ext import commands, tasks
+
+from .base import BaseCog
+from .utils.db.database import DBFilter
+from .utils.http import RequestFailed
+from .utils.ical import parse_events
+from .utils.messages import MessageBox
+from .utils.scheduler import Scheduler
+
+
+class Deadlines(BaseCog):
+    # Advisory lock key, whichever process holds it syncs the calendar.
+    sync_lock = 0x4C55434C
+    # How long before each deadline a reminder is sent.
+    reminders = (
+        ("1 week", datetime.timedelta(weeks=1)),
+        ("1 day", datetime.timedelta(days=1)),
+        ("1 hour", datetime.timedelta(hours=1)),
+    )
+    moodle_timezone = "Europe/London"
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.emoji = "⏰"
+        self.logger = logging.getLogger(__name__)
+        self.listener = None
+        # The upcoming events by UID, as they were when last loaded.
+        self.events = {}
+        self.scheduler = Scheduler(self.send_reminder)
+        self.load_lock = asyncio.Lock()
+
+    async def setup(self):
+        self.moodle_events = self.bot.database.table("moodle_event")
+        self.sent_reminders = self.bot.database.table("event_reminder")
+        self.leader = self.bot.database.advisory_lock(self.sync_lock)
+        # A setup that failed part way is run again, don't listen twice.
+        if self.listener is None:
+            self.listener = await self.bot.database.listen(
+                "moodle_event", self.on_moodle_event_notify
+            )
+        await self.load_events()
+        self.scheduler.start()
+        if self.bot.calendar_url:
+            self.sync_calendar_task.start()
+
+    def cog_unload(self):
+        self.sync_calendar_task.cancel()
+        self.scheduler.stop()
+        if self.is_setup:
+            self.bot.loop.create_task(self.leader.release())
+        if self.listener is not None:
+            self.bot.loop.create_task(self.listener.close())
+
+    def cache_sizes(self):
+        return {"events": len(self.events), "reminders": len(self.scheduler)}
+
+    @commands.command()
+    async def deadlines(self, ctx):
+        """Displays the upcoming deadlines on Moodle."""
+        now = datetime.datetime.utcnow()
+        events = sorted(
+            (event for event in self.events.values() if event.due_at > now),
+            key=lambda event: event.due_at,
+        )[:10]
+        if not events:
+            return await ctx.send(embed=MessageBox.info("No upcoming deadlines."))
+
+        embed = discord.Embed(title="Upcoming Deadlines", colour=0xFF0000)
+        for event in events:
+            embed.add_field(
+                name=event.summary[:256],
+                value=f"{event.course or 'Moodle'}, {self.local_time(event.due_at)}",
+                inline=False,
+            )
+        await ctx.send(embed=embed)
+
+    def local_time(self, due_at):
+        from dateutil import tz
+
+        due = due_at.replace(tzinfo=datetime.timezone.utc)
+        due = due.astimezone(tz.gettz(self.moodle_timezone))
+        return f"{due:%A %d %B at %H:%M}"
+
+    async def sync_calendar(self):
+        """Bring moodle_event in line with the calendar export by UID, only
+        writing the events that were added, changed or removed. Returns
+        whether anything changed."""
+        resp = await self.bot.web.get(self.bot.calendar_url)
+        if resp.status != 200:
+            raise RequestFailed(f"Calendar export returned HTTP {resp.status}")
+
+        exported = {
+            event["UID"]: {
+                "summary": event.get("SUMMARY", ""),
+                "description": event.get("DESCRIPTION", ""),
+                "course": event.get("CATEGORIES", ""),
+                "due_at": event["DTSTART"],
+            }
+            for event in parse_events(resp.text)
+            if "DTSTART" in event
+        }
+        stored = {event.uid: event for event in await self.moodle_events.all()}
+
+        added = exported.keys() - stored.keys()
+        removed = stored.keys() - exported.keys()
+        changed = [
+            uid
+            for uid in exported.keys() & stored.keys()
+            if any(stored[uid][k] != v for k, v in exported[uid].items())
+        ]
+
+        for uid in added:
+            await self.moodle_events.new_record(uid=uid, **exported[uid])
+        for uid in changed:
+            await self.moodle_events.update_records(
+                where=DBFilter(uid=uid),
+                synced_at=datetime.datetime.utcnow(),
+                **exported[uid],
+            )
+        if removed:
+            await self.moodle_events.delete_records(
+                where=DBFilter(uid__in=list(removed))
+            )
+
+        if added or changed or removed:
+            self.logger.info(
+                f"Calendar synced, {len(added)} added, {len(changed)} changed "
+                f"and {len(removed)} removed."
+            )
+        return bool(added or changed or removed)
+
+    async def load_events(self):
+        """Load the upcoming events and reschedule the reminders of any that
+        were added, moved or removed since the last load. Each event is also
+        scheduled with no reminder at its due time, which drops it."""
+        async with self.load_lock:
+            now = datetime.datetime.utcnow()
+            records = await self.moodle_events.filter(where=DBFilter(due_at__gt=now))
+            events = {event.uid: event for event in records}
+
+            for uid in self.events.keys() - events.keys():
+                for reminder, _ in self.reminders:
+                    self.scheduler.cancel((uid, reminder))
+                self.scheduler.cancel((uid, None))
+
+            for uid, event in events.items():
+                old = self.events.get(uid)
+                if old is not None and old.due_at == event.due_at:
+                    continue
+                for reminder, before in self.reminders:
+                    when = event.due_at - before
+                    if when > now:
+                        self.scheduler.schedule((uid, reminder), when, reminder)
+                    else:
+                        self.scheduler.cancel((uid, reminder))
+                self.scheduler.schedule((uid, None), event.due_at)
+
+            self.events = events
+
+    async def send_reminder(self, key, reminder):
+        """Remind every guild this process can see about an event."""
+        uid, _ = key
+        if reminder is None:
+            # The event is due, there's nothing left to remind anyone of.
+            self.events.pop(uid, None)
+            return
+        event = self.events.get(uid)
+        if event is None:
+            return
+
+        embed = discord.Embed(
+            title=event.summary[:256],
+            colour=0xFF0000,
+            description=f"Due in {reminder}, {self.local_time(event.due_at)}.",
+        )
+        if event.course:
+            embed.set_footer(text=event.course)
+
+        for guild in self.bot.guilds:
+            channel_id = await self.bot.database.get_setting(
+                guild, "announcement_channel"
+            )
+            channel = guild.get_channel(channel_id) if channel_id else None
+            if channel is None:
+                continue
+
+            # Claim the reminder first, so that a restart or another process
+            # can't send it again.
+            claimed = await self.sent_reminders.new_record_if_absent(
+                guild_id=guild.id, uid=uid, reminder=reminder, due_at=event.due_at
+            )
+            if not claimed:
+                continue
+            try:
+                await channel.send(embed=embed)
+            except discord.HTTPException:
+                self.logger.exception(f"Failed to send a reminder to {guild.id}.")
+                await self.sent_reminders.delete_records(
+                    where=DBFilter(
+                        guild_id=guild.id,
+                        uid=uid,
+                        reminder=reminder,
+                        due_at=event.due_at,
+                    )
+                )
+
+    def on_moodle_event_notify(self, connection, pid, channel, payload):
+        # The calendar was synced by whichever process holds the lock.
+        self.bot.loop.create_task(self.load_events())
+
+    @tasks.loop(hours=1)
+    async def sync_calendar_task(self):
+        try:
+            if not await self.leader.acquire():
+                return
+            if await self.sync_calendar():
+                await self.bot.database.notify("moodle_event")
+                await self.load_events()
+        except RequestFailed as e:
+            self.logger.warning(f"Couldn't sync the calendar: {e}")
+        except Exception:
+            # A malformed export or a database error, retried next hour.
+            self.logger.exception("Calendar sync failed.")
+
+
+def setup(bot):
+    bot.add_cog(Deadlines(bot))
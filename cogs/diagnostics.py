@@ -0,0 +1,274 @@
+import asyncio
+import copy
+import datetime
+import io
+import logging
+import resource
+
+import discord
+from aiohttp import web
+from discord.ext import commands, tasks
+
+from .base import BaseCog
+from .utils.messages import MessageBox
+from .utils.metrics import Histogram
+from .utils.profiling import Profiler, ProfilerBusy, profile_next_run
+
+
+def rss():
+    """The resident set size of this process in bytes. ru_maxrss is the peak
+    rather than the current size, so it's only used where /proc isn't."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Diagnostics(BaseCog):
+    # How long profiletask waits for a run to finish once it is due, in
+    # seconds.
+    profile_timeout = 600
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.emoji = "🩺"
+        self.logger = logging.getLogger(__name__)
+        self.metrics_runner = None
+
+    async def setup(self):
+        if self.bot.metrics_port:
+            await self.start_metrics_server(self.bot.metrics_port)
+
+    def cog_unload(self):
+        if self.metrics_runner is not None:
+            self.bot.loop.create_task(self.metrics_runner.cleanup())
+
+    async def start_metrics_server(self, port):
+        """Serve the metrics for a scraper on this host, it is never exposed
+        beyond localhost."""
+        app = web.Application()
+        app.router.add_get("/metrics", self.metrics_handler)
+        self.metrics_runner = web.AppRunner(app)
+        await self.metrics_runner.setup()
+        site = web.TCPSite(self.metrics_runner, "127.0.0.1", port, reuse_address=True)
+        await site.start()
+        self.logger.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+    async def metrics_handler(self, request):
+        return web.Response(
+            body=self.bot.metrics.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    @commands.is_owner()
+    @commands.command(hidden=True)
+    async def metrics(self, ctx, name=None):
+        """Displays the metrics recorded since startup."""
+        embed = discord.Embed(title="Metrics", colour=0x3B88C3)
+        for metric in self.bot.metrics.metrics.values():
+            if name is not None and name not in metric.name:
+                continue
+            rows = []
+            if isinstance(metric, Histogram):
+                for labels, count, mean, p50, p95 in metric.summary():
+                    label_text = " ".join(labels.values()) or "all"
+                    rows.append(
+                        f"`{label_text}` n={count} avg={mean * 1000:.0f}ms "
+                        f"p50≤{p50 * 1000:.0f}ms p95≤{p95 * 1000:.0f}ms"
+                    )
+            else:
+                for labels, value in metric.summary():
+                    label_text = " ".join(labels.values()) or "all"
+                    rows.append(f"`{label_text}` {value:g}")
+            if rows:
+                embed.add_field(
+                    name=metric.name, value="\n".join(rows)[:1024], inline=False
+                )
+
+        if not embed.fields:
+            return await ctx.send(embed=MessageBox.info("Nothing recorded yet."))
+        await ctx.send(embed=embed)
+
+    @commands.is_owner()
+    @commands.command(hidden=True)
+    async def hosts(self, ctx):
+        """Displays request counts and circuit breaker state for each host."""
+        counts = {}
+        for labels, value in self.bot.web.request_counter.summary():
+            counts.setdefault(labels["host"], []).append(f"{labels['outcome']}={value}")
+
+        embed = discord.Embed(title="Outbound Hosts", colour=0x3B88C3)
+        for name, host in self.bot.web.hosts.items():
+            embed.add_field(
+                name=name,
+                value=f"circuit {host.breaker.state}, "
+                f"{host.breaker.failures} failures in a row\n"
+                + (" ".join(counts.get(name, [])) or "no requests"),
+                inline=False,
+            )
+
+        if not embed.fields:
+            return await ctx.send(embed=MessageBox.info("No requests made yet."))
+        await ctx.send(embed=embed)
+
+    @commands.is_owner()
+    @commands.command(hidden=True)
+    async def lag(self, ctx):
+        """Displays event loop lag and the last time the loop was blocked."""
+        monitor = self.bot.lag_monitor
+        embed = discord.Embed(title="Event Loop Lag", colour=0x3B88C3)
+        embed.add_field(name="Samples", value=str(monitor.samples))
+        embed.add_field(name="Mean", value=f"{monitor.mean_lag * 1000:.1f}ms")
+        embed.add_field(name="Max", value=f"{monitor.max_lag * 1000:.1f}ms")
+        embed.add_field(
+            name=f"Stalls over {monitor.threshold * 1000:.0f}ms",
+            value=str(monitor.stalls),
+        )
+
+        stall = monitor.last_stall
+        if stall is None:
+            return await ctx.send(embed=embed)
+
+        embed.add_field(
+            name="Last Stall",
+            value=f"{stall['blocked']:.2f}s at {stall['when']:%d %B %Y %H:%M:%S}",
+            inline=False,
+        )
+        stack = discord.File(io.BytesIO(stall["stack"].encode()), "stack.txt")
+        await ctx.send(embed=embed, file=stack)
+
+    @commands.is_owner()
+    @commands.command(hidden=True)
+    async def profilecommand(self, ctx, *, command):
+        """Runs a command under the profiler and replies with where the time
+        went, e.g. `profilecommand profile Jane Smith`."""
+        message = copy.copy(ctx.message)
+        message.content = ctx.prefix + command
+        new_ctx = await self.bot.get_context(message, cls=type(ctx))
+        if new_ctx.command is None:
+            return await ctx.send(embed=MessageBox.warning(f"No command `{command}`."))
+
+        try:
+            with Profiler() as profiler:
+                await self.bot.invoke(new_ctx)
+        except ProfilerBusy as e:
+            return await ctx.send(embed=MessageBox.warning(str(e)))
+        await self.send_profile(ctx, f"`{command}`", profiler)
+
+    @commands.is_owner()
+    @commands.command(hidden=True)
+    async def profiletask(self, ctx, name):
+        """Profiles the next run of a background task and replies with where
+        the time went, e.g. `profiletask check_for_announcements_task`."""
+        running = {}
+        for cog in self.bot.cogs.values():
+            for attr in dir(type(cog)):
+                if isinstance(getattr(type(cog), attr, None), tasks.Loop):
+                    running[attr] = getattr(cog, attr)
+        if name not in running:
+            return await ctx.send(
+                embed=MessageBox.warning(
+                    f"No task `{name}`, try one of: "
+                    + ", ".join(f"`{task}`" for task in sorted(running))
+                )
+            )
+
+        task = running[name]
+        if not task.is_running():
+            return await ctx.send(
+                embed=MessageBox.warning(
+                    f"`{name}` isn't running, there's no next run to profile."
+                )
+            )
+        try:
+            future = profile_next_run(task)
+        except ProfilerBusy as e:
+            return await ctx.send(embed=MessageBox.warning(str(e)))
+        next_run = task.next_iteration
+        await ctx.send(
+            embed=MessageBox.info(
+                f"Profiling the next run of `{name}`"
+                + (f", due at {next_run:%H:%M:%S} UTC." if next_run else ".")
+            )
+        )
+        # Give up if the run hasn't finished a while after it was due, which
+        # cancels the future and puts the task back the way it was.
+        timeout = self.profile_timeout
+        if next_run is not None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            timeout += max((next_run - now).total_seconds(), 0)
+        try:
+            profiler = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return await ctx.send(
+                embed=MessageBox.warning(f"`{name}` didn't finish a run in time.")
+            )
+        except ProfilerBusy as e:
+            return await ctx.send(embed=MessageBox.warning(str(e)))
+        await self.send_profile(ctx, f"`{name}`", profiler)
+
+    async def send_profile(self, ctx, what, profiler):
+        report = discord.File(io.BytesIO(profiler.report().encode()), "profile.txt")
+        await ctx.send(
+            f"{what} took {profiler.elapsed:.3f}s, profiled with {profiler.backend}.",
+            file=report,
+        )
+
+    @commands.is_owner()
+    @commands.command(hidden=True)
+    async def memory(self, ctx):
+        """Displays the memory in use and the size of each cache."""
+        bot = self.bot
+        embed = discord.Embed(
+            title="Memory", colour=0x3B88C3, description=f"RSS {rss() / 2**20:.1f}MiB"
+        )
+
+        messages = len(bot.cached_messages)
+        embed.add_field(
+            name="discord.py",
+            value=(
+                f"{messages}/{bot._connection.max_messages or 0} messages\n"
+                f"{sum(len(g.members) for g in bot.guilds)} members\n"
+                f"{len(bot.users)} users\n{len(bot.guilds)} guilds"
+            ),
+        )
+
+        session = bot.web.session
+        if session is None or session.closed:
+            web = "No open session"
+        else:
+            web = f"Open, {len(session.cookie_jar)} cookies"
+        embed.add_field(name="Web", value=f"{web}\n{len(bot.web.hosts)} hosts")
+
+        for cog in bot.cogs.values():
+            rows = []
+            for name, method in vars(type(cog)).items():
+                if hasattr(method, "cache_info"):
+                    info = method.cache_info()
+                    rows.append(
+                        f"`{name}` {info.currsize}/{info.maxsize} "
+                        f"hits={info.hits} misses={info.misses}"
+                    )
+            if isinstance(cog, BaseCog):
+                rows.extend(
+                    f"`{name}` {size}" for name, size in cog.cache_sizes().items()
+                )
+            if rows:
+                embed.add_field(
+                    name=cog.qualified_name, value="\n".join(rows)[:1024], inline=False
+                )
+        await ctx.send(embed=embed)
+
+    @commands.is_owner()
+    @commands.command(hidden=True)
+    async def startup(self, ctx):
+        """Displays how long the bot took to become ready."""
+        await ctx.send(embed=MessageBox.info(f"Ready in {self.bot.startup.summary()}"))
+
+
+def setup(bot):
+    bot.add_cog(Diagnostics(bot))
@@ -1,7 +1,7 @@
+import asyncio
 import datetime
 import inspect
 import io
-import subprocess
 import traceback
 from contextlib import redirect_stdout
 
@@ -10,7 +10,7 @@ import humanize
 from discord.ext import commands
 
 from .utils.db.database import DBFilter
-from .utils.messages import MessageBox
+from .utils.messages import LazyMember, MessageBox
 
 from .base import BaseCog
 
@@ -75,8 +75,13 @@ class General(BaseCog):
         message = await ctx.send(
             embed=MessageBox.loading("Checking GitHub for updates.")
         )
-        out = subprocess.run("git pull", capture_output=True, shell=True)
-        status = out.stdout.decode().strip().split("\n")[-1]
+        process = await asyncio.create_subprocess_shell(
+            "git pull",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, _ = await process.communicate()
+        status = stdout.decode().strip().split("\n")[-1]
         if status == "Already up to date.":
             await message.edit(embed=MessageBox.info(status))
         else:
@@ -122,7 +127,7 @@ class General(BaseCog):
         await ctx.send(embed=MessageBox.info(f"I have been online for {uptime_string}"))
 
     @commands.command()
-    async def userinfo(self, ctx, member: discord.Member):
+    async def userinfo(self, ctx, member: LazyMember):
         """Displays information about a user."""
         now = datetime.datetime.now()
 
@@ -186,6 +191,8 @@ class General(BaseCog):
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx, exception):
+        self.bot.observe_command(ctx, "error")
+
         responses = {
             commands.errors.NoPrivateMessage: "This command can only be used in servers",
             commands.errors.PrivateMessageOnly: "This command can only be used in private messages",
@@ -1,103 +1,262 @@
+import asyncio
 import datetime
+import email.utils
 import json
 import logging
 import os
 import re
+import xml.etree.ElementTree as ET
 from contextlib import asynccontextmanager
 
-import aiohttp
 import discord
-import xmltodict
 from async_lru import alru_cache
-from bs4 import BeautifulSoup
-from dateutil import parser
 from discord.ext import commands, tasks
-from markdownify import markdownify
-from dateutil.parser import isoparse
 
 from .base import BaseCog
 from .utils.db.database import DBFilter
-from .utils.db.fields import *
+from .utils.http import HostPolicy, RequestFailed
+from .utils.messages import MessageBox, SearchQuery, send_embeds
+from .utils.metrics import collect_stages, stage
+from .utils.workers import WorkerPool
+
+
+# bs4, lxml, markdownify and dateutil are slow to import and only needed
+# once scraping starts, so they are imported where they are used.
+def parse_html(html):
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(html, "lxml")
 
 
 class Lancaster(BaseCog):
+    # Advisory lock key, whichever process holds it is the one polling Moodle.
+    polling_lock = 0x4C554E57
+    # How many of the latest scraped posts are considered for delivery.
+    delivery_backlog = 100
+    # The most results a search returns, this keeps searches quick however
+    # big the archive gets.
+    search_limit = 10
+    # Discord allows 10 embeds per message and 6000 characters across them.
+    digest_embeds = 10
+    digest_characters = 6000
+    # The most posts sent together in one digest, and how many deliveries
+    # may be in flight at once.
+    digest_batch = 50
+    delivery_workers = 4
+    # The soonest the workers are woken again once they have run out of
+    # due deliveries, in seconds, even if one is already due.
+    retry_delay = 5
+
+    # The forums to check, see get_news for what each entry can have.
+    forums_file = os.path.join("data", "forums.json")
+    # Moodle shows times in UK time and the feeds give them in GMT.
+    moodle_timezone = "Europe/London"
+    # Moodle's default user picture, for feed posts by someone without a
+    # staff page.
+    default_avatar = "/pix/u/f1.png"
+
+    weblogin_url = "https://weblogin.lancs.ac.uk"
+    moodle_url = "https://modules.lancaster.ac.uk"
+    staff_url = "https://www.lancaster.ac.uk"
+
     def __init__(self, bot):
         super().__init__(bot)
         self.emoji = "🌹"
         self.session = None
         self.logger = logging.getLogger(__name__)
+        self.listener = None
+        # The Last-Modified of each feed when it was last read, so that feeds
+        # which haven't changed aren't downloaded again.
+        self.feed_modified = {}
+        self.delivery_lock = asyncio.Lock()
+        self.delivery_pool = WorkerPool(
+            self.deliver_next, self.delivery_workers, idle=self.schedule_retry
+        )
+        self.retry_handle = None
+        self.check_duration = self.bot.metrics.histogram(
+            "announcements_check_seconds",
+            "Time taken by each check for new announcements.",
+        )
+        self.stage_duration = self.bot.metrics.histogram(
+            "announcements_stage_seconds",
+            "Time spent in each stage of a check for new announcements.",
+            ("stage",),
+        )
+        self.delivery_duration = self.bot.metrics.histogram(
+            "announcements_delivery_seconds",
+            "Time taken to send each message of announcements.",
+        )
 
     async def setup(self):
-        self.moodle_posts = await self.bot.database.new_table(
-            "demographics_roles",
-            (BigInteger("guild_id"), Varchar("post_id", 1000)),
+        # Moodle gets a few requests at a time, the login and staff pages
+        # are only ever needed one at a time.
+        self.bot.web.configure(self.moodle_url, HostPolicy(rate=2, concurrency=4))
+        self.bot.web.configure(self.weblogin_url, HostPolicy(rate=1, concurrency=1))
+        self.bot.web.configure(self.staff_url, HostPolicy(rate=1, concurrency=2))
+
+        self.moodle_posts = self.bot.database.table("demographics_roles")
+        self.scraped_posts = self.bot.database.table("moodle_post")
+        self.leader = self.bot.database.advisory_lock(self.polling_lock)
+        self.outbox = self.bot.database.outbox(
+            "announcement_outbox", "demographics_roles"
         )
+        # A setup that failed part way is run again, don't listen twice.
+        if self.listener is None:
+            self.listener = await self.bot.database.listen(
+                "moodle_post", self.on_moodle_post_notify
+            )
         self.check_for_announcements_task.start()
 
-    @alru_cache(maxsize=10)
+    def cog_unload(self):
+        self.check_for_announcements_task.cancel()
+        self.delivery_pool.cancel()
+        if self.retry_handle is not None:
+            self.retry_handle.cancel()
+        if self.is_setup:
+            self.bot.loop.create_task(self.leader.release())
+        if self.listener is not None:
+            self.bot.loop.create_task(self.listener.close())
+
+    def cache_sizes(self):
+        return {
+            "feed validators": len(self.feed_modified),
+            "delivery workers": len(self.delivery_pool.workers),
+        }
+
+    @alru_cache(maxsize=10, cache_exceptions=False)
     async def login_to_portal(self, username, password):
-        session = aiohttp.ClientSession()
-
-        async with session.get("https://weblogin.lancs.ac.uk/login/") as login_page:
-            html = await login_page.text()
-            soup = BeautifulSoup(html, "lxml")
-            form = soup.select_one("form#loginbox")
-            data = {f["name"]: f["value"] for f in form.find_all("input")}
-            data["username"] = username
-
-        async with session.post(
-            "https://weblogin.lancs.ac.uk/login/", data=data
-        ) as pw_page:
-            html = await pw_page.text()
-            soup = BeautifulSoup(html, "lxml")
-            form = soup.select_one("form#loginbox")
-            data = {f["name"]: f["value"] for f in form.find_all("input")}
-            data["password"] = password
-
-        resp = await session.post("https://weblogin.lancs.ac.uk/login/", data=data)
-        html = await resp.text()
-        if "You are logged into" in html:
-            return session
+        web = self.bot.web
+
+        login_page = await web.get(f"{self.weblogin_url}/login/")
+        soup = parse_html(login_page.text)
+        form = soup.select_one("form#loginbox")
+        data = {f["name"]: f["value"] for f in form.find_all("input")}
+        data["username"] = username
+
+        pw_page = await web.post(f"{self.weblogin_url}/login/", data=data)
+        soup = parse_html(pw_page.text)
+        form = soup.select_one("form#loginbox")
+        data = {f["name"]: f["value"] for f in form.find_all("input")}
+        data["password"] = password
 
+        resp = await web.post(f"{self.weblogin_url}/login/", data=data)
+        if "You are logged into" in resp.text:
+            return web
+
+    @alru_cache(maxsize=256, cache_exceptions=False)
     async def get_profile_picture(self, name):
-        session = await self.login_to_portal(*self.bot.login_data)
+        web = await self.login_to_portal(*self.bot.login_data)
 
         slug = "-".join(name.lower().split())
-        resp = await session.get(
-            "https://www.lancaster.ac.uk/scc/about-us/people/" + slug
-        )
+        with stage("fetch"):
+            resp = await web.get(f"{self.staff_url}/scc/about-us/people/{slug}")
 
         if resp.status != 200:
             return None
 
-        text = await resp.text()
-        soup = BeautifulSoup(text, "lxml")
-
-        return soup.select_one(".image-wrapper img").get("src")
+        with stage("parse"):
+            soup = parse_html(resp.text)
+            return soup.select_one(".image-wrapper img").get("src")
 
     @commands.command()
     async def profile(self, ctx, *, name):
-        profile = await self.get_profile_picture(name)
+        try:
+            profile = await self.get_profile_picture(name)
+        except RequestFailed:
+            return await ctx.send("The staff pages aren't responding, try again later.")
         if profile is not None:
             await ctx.send(profile)
         else:
             await ctx.send("Not found.")
 
-    async def get_news(self):
-        with open(os.path.join("data", "forums.json")) as forums_file:
+    @commands.command()
+    async def search(self, ctx, *, query: SearchQuery):
+        """Searches every announcement the bot has seen. Narrow it down with
+        `forum:<name>`, `after:<YYYY-MM-DD>` and `before:<YYYY-MM-DD>`."""
+        results = await self.search_posts(**query)
+        if not results:
+            return await ctx.send(embed=MessageBox.info("No announcements found."))
+
+        embed = discord.Embed(
+            title=f"Announcements matching '{query['terms']}'", colour=0xFF0000
+        )
+        embed.description = "\n".join(
+            [
+                f"{n}. [{post['title']}]({post['url']})\n"
+                f"{post['forum']} - {post['author']}, {post['date']:%d %B %Y}"
+                for n, post in enumerate(results, start=1)
+            ]
+        )[:2048]
+        await ctx.send(embed=embed)
+
+    async def search_posts(self, terms, forum=None, after=None, before=None):
+        """Search the scraped posts, best matches first, without going
+        anywhere near Moodle."""
+        values = [terms]
+        conditions = ["search @@ query"]
+        if forum is not None:
+            values.append(f"%{forum}%")
+            conditions.append(f"forum ILIKE ${len(values)}")
+        if after is not None:
+            values.append(after)
+            conditions.append(f"date >= ${len(values)}")
+        if before is not None:
+            values.append(before)
+            conditions.append(f"date < ${len(values)}")
+
+        return await self.bot.database.fetch(
+            "SELECT title, author, forum, url, date, ts_rank(search, query) AS rank "
+            "FROM moodle_post, websearch_to_tsquery('english', $1) query "
+            f"WHERE {' AND '.join(conditions)} "
+            f"ORDER BY rank DESC, date DESC LIMIT {self.search_limit};",
+            *values,
+        )
+
+    async def get_news(self, seen=(), modified=None):
+        """Get the posts on every forum in forums_file, newest first.
+
+        Each forum has a 'name' and an 'id', and may have an 'rss' feed path
+        with {token} where the RSS token goes and a 'backend' of "rss" or
+        "html". Forums with a feed are read from it when a token is set,
+        stopping at the first post in 'seen', and every other forum, or one
+        whose feed fails, is scraped from its HTML page. The Last-Modified
+        of each feed read is put in 'modified', see get_forum_feed."""
+        with open(self.forums_file) as forums_file:
             forum_data = json.load(forums_file)
 
         announcements = []
-        session = await self.login_to_portal(*self.bot.login_data)
         for forum in forum_data:
-            resp = await session.get(
-                f"https://modules.lancaster.ac.uk/mod/forum/view.php?id={forum['id']}"
+            backend = forum.get("backend", "rss" if "rss" in forum else "html")
+            if backend == "rss" and "rss" in forum and self.bot.rss_token:
+                try:
+                    announcements.extend(
+                        await self.get_forum_feed(forum, seen, modified)
+                    )
+                    continue
+                except (RequestFailed, ET.ParseError) as e:
+                    self.logger.warning(
+                        f"Couldn't read the feed for {forum['name']}, "
+                        f"scraping its page instead: {e}"
+                    )
+            announcements.extend(await self.get_forum_page(forum))
+
+        latest = sorted(announcements, key=lambda x: x["date"], reverse=True)
+        return latest
+
+    async def get_forum_page(self, forum):
+        """Scrape the posts listed on a forum's HTML page."""
+        announcements = []
+        web = await self.login_to_portal(*self.bot.login_data)
+        with stage("fetch"):
+            resp = await web.get(
+                f"{self.moodle_url}/mod/forum/view.php?id={forum['id']}"
             )
-            content = await resp.text()
-            soup = BeautifulSoup(content, "lxml")
+        with stage("parse"):
+            soup = parse_html(resp.text)
             rows = soup.select_one("tbody").find_all("tr")
 
-            for row in rows:
+        for row in rows:
+            with stage("parse"):
                 icon, group, author, *other = row.find_all("td")
                 title = row.select_one("th").text.strip()
                 avatar = author.select_one("img")["src"]
@@ -110,58 +269,205 @@ class Lancaster(BaseCog):
 
                 author_name, date = author.select_one(".author-info").find_all("div")
 
+            try:
                 pfp = await self.get_profile_picture(author_name.text.strip())
-                if pfp is not None:
-                    avatar = pfp
-
-                announcement = {
-                    "title": title.strip(),
-                    "author": author_name.text.strip(),
-                    "date": datetime.datetime.strptime(date.text.strip(), "%d %b %Y"),
-                    "url": "https://modules.lancaster.ac.uk/mod/forum/discuss.php?d="
-                    + str(_id),
-                    "avatar": avatar,
-                    "id": _id,
-                }
-                announcements.append(announcement)
+            except RequestFailed:
+                # The Moodle avatar will do while the staff pages are down.
+                pfp = None
+            if pfp is not None:
+                avatar = pfp
+
+            announcement = {
+                "forum": forum["name"],
+                "title": title.strip(),
+                "author": author_name.text.strip(),
+                "date": datetime.datetime.strptime(date.text.strip(), "%d %b %Y"),
+                "url": f"{self.moodle_url}/mod/forum/discuss.php?d={_id}",
+                "avatar": avatar,
+                "id": _id,
+            }
+            announcements.append(announcement)
+
+        return announcements
+
+    async def get_forum_feed(self, forum, seen=(), modified=None):
+        """Read the posts in a forum's RSS feed, newest first, stopping at the
+        first post in 'seen'. Items include the whole post, so
+        get_extra_details isn't needed for them.
+
+        The feed's Last-Modified is put in 'modified' by URL rather than
+        straight into feed_modified, the caller does that once the posts are
+        saved so that a failed save doesn't hide them behind a 304."""
+        url = self.moodle_url + forum["rss"].format(token=self.bot.rss_token)
+        headers = {}
+        if url in self.feed_modified:
+            headers["If-Modified-Since"] = self.feed_modified[url]
 
-        latest = sorted(announcements, key=lambda x: x["date"], reverse=True)
-        return latest
+        announcements = []
+        async with self.bot.web.stream(url, headers=headers) as feed:
+            if feed.status == 304:
+                return announcements
+            if feed.status != 200:
+                raise RequestFailed(f"GET {url} failed: HTTP {feed.status}")
+
+            async for item in self.feed_items(feed):
+                match = re.search(r"[?&]d=(\d+)", item.findtext("link", ""))
+                if match is None:
+                    # Not a discussion, there is nothing to link to.
+                    continue
+                _id = match.group(1)
+                if _id in seen:
+                    break
+                announcements.append(await self.feed_announcement(forum, _id, item))
+
+        if modified is not None and "Last-Modified" in feed.headers:
+            modified[url] = feed.headers["Last-Modified"]
+        return announcements
+
+    async def feed_items(self, feed):
+        """Yield the items of an RSS feed as they arrive, so that reading can
+        stop without downloading or parsing the rest of it."""
+        parser = ET.XMLPullParser(events=("end",))
+        while True:
+            with stage("fetch"):
+                chunk = await feed.read()
+            if not chunk:
+                return
+            with stage("parse"):
+                parser.feed(chunk)
+                items = [
+                    element
+                    for event, element in parser.read_events()
+                    if element.tag == "item"
+                ]
+            for item in items:
+                yield item
+
+    async def feed_announcement(self, forum, _id, item):
+        """Turn an RSS item from a forum feed into an announcement."""
+        from dateutil import tz
+        from markdownify import markdownify
+
+        with stage("parse"):
+            # Moodle puts the author at the start of the description rather
+            # than in an author element.
+            match = re.match(
+                r"by (.+?)\.(?:\s|&nbsp;|\xa0)*(.*)$",
+                item.findtext("description", ""),
+                re.DOTALL,
+            )
+            author, body = (
+                match.groups() if match else ("", item.findtext("description"))
+            )
+            posted_at = email.utils.parsedate_to_datetime(item.findtext("pubDate"))
+            posted_at = posted_at.astimezone(tz.gettz(self.moodle_timezone))
+            posted_at = posted_at.replace(tzinfo=None)
+            title = item.findtext("title", "").strip()
+            description = markdownify(body)
+            item.clear()
+
+        avatar = f"{self.moodle_url}{self.default_avatar}"
+        if author:
+            try:
+                avatar = await self.get_profile_picture(author) or avatar
+            except RequestFailed:
+                pass
 
-    @alru_cache(maxsize=100)
+        return {
+            "forum": forum["name"],
+            "title": title,
+            "author": author,
+            "date": datetime.datetime.combine(posted_at.date(), datetime.time()),
+            "url": f"{self.moodle_url}/mod/forum/discuss.php?d={_id}",
+            "avatar": avatar,
+            "id": _id,
+            "details": {"description": description, "posted_at": posted_at},
+        }
+
+    @alru_cache(maxsize=100, cache_exceptions=False)
     async def get_extra_details(self, _id):
-        session = await self.login_to_portal(*self.bot.login_data)
-        url = f"https://modules.lancaster.ac.uk/mod/forum/discuss.php?d={_id}"
-        resp = await session.get(url)
-        content = await resp.text()
-        soup = BeautifulSoup(content, "lxml")
-
-        description = markdownify(str(soup.select_one(".post-content-container")))
-        read_more_button = f"...\n\n[Read The Rest On Moodle]({url})"
-        max_length = 2048 - len(read_more_button)
-        if len(description) > max_length:
-            description = description[:max_length] + read_more_button
+        from dateutil.parser import isoparse
+        from markdownify import markdownify
+
+        web = await self.login_to_portal(*self.bot.login_data)
+        url = f"{self.moodle_url}/mod/forum/discuss.php?d={_id}"
+        with stage("fetch"):
+            resp = await web.get(url)
+
+        with stage("parse"):
+            soup = parse_html(resp.text)
+            description = markdownify(str(soup.select_one(".post-content-container")))
+            date = isoparse(soup.select_one("time")["datetime"])
 
         return {
             "description": description,
-            "date": isoparse(soup.select_one("time")["datetime"]).strftime(
-                "%A, %d %B %Y, %H:%M"
-            ),
+            # Stored as a naive timestamp in Moodle's local time.
+            "posted_at": date.replace(tzinfo=None),
         }
 
-    async def news_embed(self, data):
-        details = await self.get_extra_details(data["id"])
+    def news_embed(self, post, max_length=2048):
+        """Build the embed for a post stored in the moodle_post table."""
+        description = post.description
+        read_more_button = f"...\n\n[Read The Rest On Moodle]({post.url})"
+        if len(description) > max_length:
+            cut = max(max_length - len(read_more_button), 0)
+            description = description[:cut] + read_more_button
 
         embed = discord.Embed(
-            title=data["title"],
-            url=data["url"],
+            title=post.title,
+            url=post.url,
             colour=0xFF0000,
-            description=details["description"],
+            description=description,
         )
-        embed.set_author(name=data["author"], icon_url=data["avatar"])
-        embed.set_footer(text=details["date"])
+        embed.set_author(name=post.author, icon_url=post.avatar)
+        embed.set_footer(text=post.posted_at.strftime("%A, %d %B %Y, %H:%M"))
         return embed
 
+    def digest_embeds_for(self, posts):
+        """Build the embeds for a digest message, one per post if they fit in
+        a message, otherwise a single embed listing them all."""
+        if len(posts) <= self.digest_embeds:
+            # Share the character limit out, leaving room in each embed for
+            # its title, author and footer.
+            per_embed = self.digest_characters // len(posts)
+            return [
+                self.news_embed(
+                    post,
+                    min(2048, per_embed - len(post.title) - len(post.author) - 50),
+                )
+                for post in posts
+            ]
+
+        embed = discord.Embed(
+            title=f"{len(posts)} new announcements",
+            colour=0xFF0000,
+        )
+        # Whole lines only, so that a link is never cut in half, with room
+        # left to say how many didn't fit.
+        lines = []
+        length = len(f"…and {len(posts)} more")
+        for post in posts:
+            line = f"[{post.title}]({post.url}) - {post.author}, {post.forum}"
+            length += len(line) + 1
+            if length > 2048:
+                lines.append(f"…and {len(posts) - len(lines)} more")
+                break
+            lines.append(line)
+        embed.description = "\n".join(lines)
+        return [embed]
+
+    @commands.is_owner()
+    @commands.command()
+    async def announcementdigest(self, ctx, enabled: bool):
+        """Sends announcements found at the same time as one message."""
+        await self.bot.database.set_setting(
+            ctx.guild, "announcement_digest", True if enabled else None
+        )
+        if enabled:
+            await ctx.send("New announcements will be sent together as a digest")
+        else:
+            await ctx.send("New announcements will be sent one at a time")
+
     @commands.is_owner()
     @commands.command()
     async def announcementchannel(self, ctx, channel: discord.TextChannel = None):
@@ -178,38 +484,193 @@ class Lancaster(BaseCog):
     async def get_announcement_channel(self, guild):
         channel_id = await self.bot.database.get_setting(guild, "announcement_channel")
         if channel_id:
-            return guild.get_channel(int(channel_id))
-
-    async def check_moodle_post_exists(self, guild_id, post_id):
-        exists = await self.moodle_posts.filter(
-            where=DBFilter(guild_id=int(guild_id), post_id=str(post_id))
-        )
-        return bool(exists)
+            return guild.get_channel(channel_id)
 
     async def check_for_announcements(self):
+        with collect_stages() as stages, self.check_duration.time():
+            await self._check_for_announcements()
+        for name, seconds in stages.items():
+            self.stage_duration.observe(seconds, stage=name)
+
+    async def _check_for_announcements(self):
+        # Only one process scrapes Moodle, every process delivers the
+        # scraped posts to its own guilds.
+        if await self.leader.acquire():
+            await self.scrape_announcements()
+        await self.deliver_announcements()
+
+    async def scrape_announcements(self):
+        """Store any posts on the forums that haven't been seen before."""
         self.logger.info("Checking for new announcements.")
-        announcements = await self.get_news()
-        n = 0
-        for news in reversed(announcements):
+        with stage("db"):
+            recent = await self.scraped_posts.all(
+                limit=self.delivery_backlog, order_by="id", desc=True
+            )
+        modified = {}
+        announcements = await self.get_news(
+            {record.post_id for record in recent}, modified
+        )
+        if not announcements:
+            self.feed_modified.update(modified)
+            return
+
+        with stage("db"):
+            known = await self.scraped_posts.filter(
+                where=DBFilter(post_id__in=[news["id"] for news in announcements])
+            )
+        known_ids = {record.post_id for record in known}
+        new = [news for news in announcements if news["id"] not in known_ids]
+
+        for news in reversed(new):
+            details = news.get("details") or await self.get_extra_details(news["id"])
+            with stage("db"):
+                await self.scraped_posts.new_record_if_absent(
+                    post_id=news["id"],
+                    forum=news["forum"],
+                    title=news["title"],
+                    author=news["author"],
+                    avatar=news["avatar"],
+                    url=news["url"],
+                    date=news["date"],
+                    posted_at=details["posted_at"],
+                    description=details["description"],
+                )
+        self.feed_modified.update(modified)
+
+        if new:
+            self.logger.info(f"Found {len(new)} new announcements.")
+            await self.bot.database.notify("moodle_post")
+        else:
+            self.logger.info("No new announcements found.")
+
+    async def deliver_announcements(self):
+        """Queue scraped posts for every guild this process can see which
+        hasn't had them yet, then wake the delivery workers."""
+        async with self.delivery_lock:
+            with stage("db"):
+                posts = await self.scraped_posts.all(
+                    limit=self.delivery_backlog, order_by="id", desc=True
+                )
+            posts = posts[::-1]
+            if not posts:
+                return
+
+            jobs = []
             for guild in self.bot.guilds:
-                exists = await self.check_moodle_post_exists(guild.id, news["id"])
-                if not exists:
+                with stage("db"):
                     channel = await self.get_announcement_channel(guild)
-                    if channel:
-                        embed = await self.news_embed(news)
-                        await channel.send(embed=embed)
-                        await self.moodle_posts.new_record(
-                            guild_id=guild.id, post_id=news["id"]
+                    if channel is None:
+                        continue
+                    delivered = await self.moodle_posts.filter(
+                        where=DBFilter(
+                            guild_id=guild.id,
+                            post_id__in=[post.post_id for post in posts],
                         )
-                        n += 1
-        if n:
-            self.logger.info(f"Found {n} new announcements.")
-        else:
-            self.logger.info("No new announcements found.")
+                    )
+                delivered_ids = {record.post_id for record in delivered}
+                jobs.extend(
+                    {"guild_id": guild.id, "post_id": post.post_id}
+                    for post in posts
+                    if post.post_id not in delivered_ids
+                )
+
+            if jobs:
+                with stage("db"):
+                    await self.outbox.enqueue(jobs)
+        self.delivery_pool.wake()
+
+    async def deliver_next(self):
+        """Claim the oldest due delivery for one of this process's guilds
+        and send it, returns whether there was one.
+
+        Guilds in digest mode have all of their due deliveries claimed and
+        sent together. The claim is held until the send has finished, so
+        no other worker in any process can send the same posts or anything
+        else to the same guild. Any error fails the batch, so it is retried
+        with backoff."""
+        guilds = {guild.id: guild for guild in self.bot.guilds}
+        async with self.outbox.claim(guilds, self.delivery_batch_size) as batch:
+            if not batch.jobs:
+                return False
+
+            guild = guilds[batch.guild_id]
+            channel = await self.get_announcement_channel(guild)
+            if channel is None:
+                await batch.fail("No announcement channel.")
+                return True
+
+            posts = await self.scraped_posts.filter(
+                where=DBFilter(post_id__in=[job["post_id"] for job in batch.jobs])
+            )
+            if not posts:
+                await batch.fail("The posts are no longer stored.")
+                return True
+            posts.sort(key=lambda post: post.id)
+            try:
+                with self.delivery_duration.time():
+                    if len(posts) > 1:
+                        await send_embeds(channel, self.digest_embeds_for(posts))
+                    else:
+                        await channel.send(embed=self.news_embed(posts[0]))
+            except discord.HTTPException as e:
+                self.logger.warning(
+                    f"Failed to send {len(posts)} announcements to {guild.id}: {e}"
+                )
+                await batch.fail(e)
+            except Exception as e:
+                # A dropped connection or a bug, fail the batch so it backs
+                # off rather than being retried straight away by every worker.
+                self.logger.exception(
+                    f"Failed to send {len(posts)} announcements to {guild.id}."
+                )
+                await batch.fail(e)
+            else:
+                await batch.complete()
+        return True
+
+    async def delivery_batch_size(self, guild_id):
+        """How many deliveries to claim together for a guild."""
+        guild = discord.Object(guild_id)
+        if await self.bot.database.get_setting(guild, "announcement_digest"):
+            return self.digest_batch
+        return 1
+
+    async def schedule_retry(self):
+        """Wake the workers again when the next failed delivery is due."""
+        due = await self.outbox.next_available([guild.id for guild in self.bot.guilds])
+        if self.retry_handle is not None:
+            self.retry_handle.cancel()
+        if due is not None:
+            delay = (due - datetime.datetime.utcnow()).total_seconds()
+            self.retry_handle = self.bot.loop.call_later(
+                max(delay, self.retry_delay), self.delivery_pool.wake
+            )
+
+    @commands.is_owner()
+    @commands.command(hidden=True)
+    async def announcementqueue(self, ctx):
+        """Shows how many deliveries are pending, done and given up on."""
+        counts = await self.outbox.counts()
+        await ctx.send(
+            ", ".join(f"{status}: {n}" for status, n in sorted(counts.items()))
+            or "The queue is empty."
+        )
+
+    def on_moodle_post_notify(self, connection, pid, channel, payload):
+        # Another process has scraped new posts, deliver them straight away
+        # rather than waiting for the next poll.
+        self.bot.loop.create_task(self.deliver_announcements())
 
     @tasks.loop(minutes=10)
     async def check_for_announcements_task(self):
-        await self.check_for_announcements()
+        try:
+            await self.check_for_announcements()
+        except RequestFailed as e:
+            self.logger.warning(f"Skipping this announcement check: {e}")
+        except Exception:
+            # The loop would never run again if this escaped, so a database
+            # error or a page that won't parse only costs this check.
+            self.logger.exception("Announcement check failed.")
 
 
 def setup(bot):
@@ -1,6 +1,11 @@
 import asyncio
 import asyncpg
+import logging
 from .fields import *
+from .locks import AdvisoryLock
+from .models import MODELS
+from .outbox import Outbox
+from .schema import MIGRATIONS, SCHEMA_VERSION, UNFETCHED_COLUMNS, create_table
 from collections import defaultdict
 from contextlib import asynccontextmanager
 
@@ -70,12 +75,24 @@ class DBFilter:
 
 
 class DBQuery:
-    """Queries a table on the database."""
+    """Queries a table on the database. Tables with a model in
+    cogs.utils.db.models return records as instances of it, only fetching
+    the columns it has."""
 
-    def __init__(self, database, name):
+    def __init__(self, database, name, model=None):
         self.database = database
         self.url = self.database.url
         self.name = name
+        self.model = model
+        if model is not None:
+            self.columns_sql = ", ".join(f'"{c.name}"' for c in model.columns)
+        else:
+            self.columns_sql = "*"
+
+    def _records(self, records):
+        if self.model is None:
+            return records
+        return [self.model(*record) for record in records]
 
     async def all(self, limit=None, order_by=None, desc=False):
         """Get all records in the table."""
@@ -86,9 +103,10 @@ class DBQuery:
             else ""
         )
         async with self.database.connection() as conn:
-            return await conn.fetch(
-                f"SELECT * FROM {self.name} {order_by_sql} {limit_sql};"
+            records = await conn.fetch(
+                f"SELECT {self.columns_sql} FROM {self.name} {order_by_sql} {limit_sql};"
             )
+        return self._records(records)
 
     async def filter(self, where: DBFilter, limit=None, order_by=None, desc=False):
         """Get records in the table based on a filter."""
@@ -100,10 +118,12 @@ class DBQuery:
         )
         where_sql, where_values = where.sql()
         async with self.database.connection() as conn:
-            return await conn.fetch(
-                f"SELECT * FROM {self.name} {where_sql} {order_by_sql} {limit_sql};",
+            records = await conn.fetch(
+                f"SELECT {self.columns_sql} FROM {self.name} "
+                f"{where_sql} {order_by_sql} {limit_sql};",
                 *where_values,
             )
+        return self._records(records)
 
     async def new_record(self, **kwargs):
         """Create a new record in a database."""
@@ -115,6 +135,19 @@ class DBQuery:
                 *kwargs.values(),
             )
 
+    async def new_record_if_absent(self, **kwargs):
+        """Create a new record unless it would break a unique constraint,
+        returns whether the record was created."""
+        fields_sql = ", ".join(kwargs.keys())
+        values_sql = ", ".join([f"${n}" for n, _ in enumerate(kwargs, start=1)])
+        async with self.database.connection() as conn:
+            status = await conn.execute(
+                f"INSERT INTO {self.name} ({fields_sql}) VALUES ({values_sql}) "
+                "ON CONFLICT DO NOTHING;",
+                *kwargs.values(),
+            )
+        return status == "INSERT 0 1"
+
     async def new_record_with_id(self, **kwargs):
         """Create a new record in a database and return the 'id' value.
         Note: this only works on tables with a SerialIdentifier field."""
@@ -162,26 +195,102 @@ class Database:
     easily and asyncronously."""
 
     settings_table = "server_setting"
+    version_table = "schema_version"
+    # Arbitrary key for the advisory lock that serialises migrations
+    # between processes sharing the same database.
+    migration_lock = 0x4C554D47
 
     def __init__(self, url, ssl=False):
         self.url = url + ("?sslmode=require" if ssl else "")
+        self.schema_version = None
+        self._migrate_lock = asyncio.Lock()
+        self.logger = logging.getLogger(__name__)
 
     async def connect(self):
-        await self.new_table(
-            self.settings_table,
-            (
-                BigInteger("guild_id"),
-                Text("key"),
-                Text("value"),
-            ),
+        """Bring the schema up to date, this only does work once per process."""
+        async with self._migrate_lock:
+            if self.schema_version is None:
+                self.schema_version = await self.migrate()
+                await self.check_tables()
+
+    async def migrate(self):
+        """Apply any migrations newer than the stored schema version."""
+        async with self.connection() as conn:
+            version = await self._get_schema_version(conn)
+            if version >= SCHEMA_VERSION:
+                return version
+
+            async with conn.transaction():
+                await conn.execute(
+                    "SELECT pg_advisory_xact_lock($1);", self.migration_lock
+                )
+                await conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.version_table} "
+                    "(version INT NOT NULL);"
+                )
+                # Another process may have migrated while we waited for the lock.
+                version = await self._get_schema_version(conn)
+                if version >= SCHEMA_VERSION:
+                    return version
+                for statements in MIGRATIONS[version:]:
+                    for statement in statements:
+                        await conn.execute(statement)
+                await conn.execute(f"DELETE FROM {self.version_table};")
+                await conn.execute(
+                    f"INSERT INTO {self.version_table} (version) VALUES ($1);",
+                    SCHEMA_VERSION,
+                )
+            return SCHEMA_VERSION
+
+    async def check_tables(self):
+        """Compare the columns each model reads with the ones the migrations
+        created. A column the database lacks would fail every query, and one
+        the model doesn't know about would never be read."""
+        async with self.connection() as conn:
+            records = await conn.fetch(
+                "SELECT table_name, column_name FROM information_schema.columns "
+                "WHERE table_schema = current_schema() "
+                "AND table_name = ANY($1::text[]);",
+                list(MODELS),
+            )
+        columns = defaultdict(set)
+        for record in records:
+            columns[record["table_name"]].add(record["column_name"])
+
+        for table, model in MODELS.items():
+            missing = model.names - columns[table]
+            if missing:
+                raise RuntimeError(
+                    f"{table} has no {', '.join(sorted(missing))} column, "
+                    "schema.TABLES doesn't match the migrations."
+                )
+            unread = (
+                columns[table] - model.names - set(UNFETCHED_COLUMNS.get(table, ()))
+            )
+            if unread:
+                self.logger.warning(
+                    f"{table} has columns {', '.join(sorted(unread))} which are "
+                    "missing from schema.TABLES and will never be fetched."
+                )
+
+    async def _get_schema_version(self, conn):
+        exists = await conn.fetchval(
+            "SELECT to_regclass($1) IS NOT NULL;", self.version_table
         )
+        if exists:
+            return (
+                await conn.fetchval(f"SELECT MAX(version) FROM {self.version_table};")
+                or 0
+            )
+        return 0
 
     async def get_setting(self, guild, key):
+        """Get a guild's setting, as the type given for it in schema.SETTINGS."""
         records = await self.table(self.settings_table).filter(
             where=DBFilter(guild_id=guild.id, key=key)
         )
         if records:
-            return records[0]["value"]
+            return records[0].value
 
     async def set_setting(self, guild, key, value):
         await self.table(self.settings_table).delete_records(
@@ -193,10 +302,10 @@ class Database:
             )
 
     async def new_table(self, name, fields):
-        fields = [SerialIdentifier()] + list(fields)
-        fields = ", ".join([f'"{f.name}" {f.datatype}' for f in fields])
+        """Create a table outside of the migrations, prefer adding a migration
+        to cogs.utils.db.schema for anything the bot always needs."""
         async with self.connection() as conn:
-            await conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ({fields});")
+            await conn.execute(create_table(name, fields))
         return self.table(name)
 
     @asynccontextmanager
@@ -207,6 +316,11 @@ class Database:
         finally:
             await conn.close()
 
+    async def fetch(self, sql_query, *args):
+        """Run an SQL query with $n placeholders and return the records."""
+        async with self.connection() as conn:
+            return await conn.fetch(sql_query, *args)
+
     async def execute_sql(self, sql_query):
         """Execute an SQL query manually."""
         if not sql_query.endswith(";"):
@@ -214,5 +328,24 @@ class Database:
         async with self.connection() as conn:
             return await conn.fetch(sql_query)
 
+    async def listen(self, channel, callback):
+        """Call 'callback' for every NOTIFY on 'channel', returns the
+        listening connection which should be closed when done."""
+        conn = await asyncpg.connect(self.url)
+        await conn.add_listener(channel, callback)
+        return conn
+
+    async def notify(self, channel, payload=""):
+        async with self.connection() as conn:
+            await conn.execute("SELECT pg_notify($1, $2);", channel, payload)
+
+    def advisory_lock(self, key):
+        return AdvisoryLock(self, key)
+
+    def outbox(self, name, log, **kwargs):
+        """A queue of (guild_id, post_id) jobs in table 'name', finished jobs
+        are recorded in table 'log'."""
+        return Outbox(self, name, log, **kwargs)
+
     def table(self, name):
-        return DBQuery(self, name)
+        return DBQuery(self, name, MODELS.get(name))
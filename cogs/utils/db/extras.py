@@ -3,7 +3,7 @@
 async def get_role(database, guild, name):
     role = await database.get_setting(guild, name)
     if role:
-        return guild.get_role(int(role))
+        return guild.get_role(role)
 
 
 async def set_role(database, guild, name, role):
@@ -1,9 +1,13 @@
+import json
 
 
 class Field:
     """Represents a field in a database table"""
 
     _datatype = None
+    # What values are converted to when read, None leaves them as asyncpg
+    # returns them.
+    python_type = None
 
     def __init__(self, field_name, *, default=None):
         self.name = field_name
@@ -17,9 +21,18 @@ class Field:
             dt += f" DEFAULT {self.default}"
         return dt
 
+    def to_python(self, value, record=None):
+        """Convert a value read from the database, or stored as text."""
+        if value is None or self.python_type is None:
+            return value
+        if isinstance(value, self.python_type):
+            return value
+        return self.python_type(value)
+
 
 class SerialIdentifier(Field):
     _datatype = "SERIAL PRIMARY KEY"
+    python_type = int
 
     def __init__(self):
         super().__init__("id")
@@ -27,10 +40,17 @@ class SerialIdentifier(Field):
 
 class Boolean(Field):
     _datatype = "BOOLEAN"
+    python_type = bool
+
+    def to_python(self, value, record=None):
+        if isinstance(value, str):
+            return value == "True"
+        return super().to_python(value)
 
 
 class Char(Field):
     _datatype = "CHAR({n})"
+    python_type = str
 
     def __init__(self, field_name, length, **kwargs):
         super().__init__(field_name, **kwargs)
@@ -39,6 +59,7 @@ class Char(Field):
 
 class Varchar(Field):
     _datatype = "VARCHAR({n})"
+    python_type = str
 
     def __init__(self, field_name, length, **kwargs):
         super().__init__(field_name, **kwargs)
@@ -47,22 +68,27 @@ class Varchar(Field):
 
 class Text(Field):
     _datatype = "TEXT"
+    python_type = str
 
 
 class SmallInteger(Field):
     _datatype = "SMALLINT"
+    python_type = int
 
 
 class Integer(Field):
     _datatype = "INT"
+    python_type = int
 
 
 class BigInteger(Field):
     _datatype = "BIGINT"
+    python_type = int
 
 
 class Real(Field):
     _datatype = "REAL"
+    python_type = float
 
 
 class Date(Field):
@@ -79,3 +105,25 @@ class Timestamp(Field):
 
 class Json(Field):
     _datatype = "JSON"
+
+    def to_python(self, value, record=None):
+        # asyncpg returns json columns as text.
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+
+class Setting(Text):
+    """A text column holding values whose type depends on another column,
+    'types' maps each value of column 'by' to the field to convert with."""
+
+    def __init__(self, field_name, *, by, types, **kwargs):
+        super().__init__(field_name, **kwargs)
+        self.by = by
+        self.types = types
+
+    def to_python(self, value, record=None):
+        field = self.types.get(getattr(record, self.by, None))
+        if field is None:
+            return value
+        return field.to_python(value)
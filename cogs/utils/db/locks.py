@@ -0,0 +1,47 @@
+import logging
+
+import asyncpg
+
+
+class AdvisoryLock:
+    """A postgres session advisory lock, held on a connection of its own so
+    that the database releases it as soon as the holding process dies.
+
+    Used for leader election: every process calls acquire() periodically
+    and whichever one holds the lock does the work."""
+
+    def __init__(self, database, key):
+        self.database = database
+        self.key = key
+        self.conn = None
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def held(self):
+        return self.conn is not None and not self.conn.is_closed()
+
+    async def acquire(self):
+        """Try to take (or keep) the lock without waiting, returns whether
+        this process holds it."""
+        if self.held:
+            try:
+                await self.conn.fetchval("SELECT 1;")
+                return True
+            except (asyncpg.PostgresError, OSError):
+                self.logger.warning(f"Lost the connection holding lock {self.key}.")
+                await self.release()
+
+        conn = await asyncpg.connect(self.database.url)
+        if await conn.fetchval("SELECT pg_try_advisory_lock($1);", self.key):
+            self.conn = conn
+            self.logger.info(f"Acquired lock {self.key}.")
+            return True
+        await conn.close()
+        return False
+
+    async def release(self):
+        """Give up the lock by closing the connection that holds it."""
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            if not conn.is_closed():
+                await conn.close()
@@ -0,0 +1,91 @@
+from .fields import SerialIdentifier
+from .schema import TABLES
+
+
+class Column:
+    """Reads one column of a model, converting the value the model was
+    created with the first time it is read."""
+
+    def __init__(self, field, slot, bit):
+        self.field = field
+        self.name = field.name
+        self.slot = slot
+        self.bit = bit
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        value = self.slot.__get__(record, owner)
+        if not record._converted & self.bit:
+            value = self.field.to_python(value, record)
+            self.slot.__set__(record, value)
+            record._converted |= self.bit
+        return value
+
+    def __set__(self, record, value):
+        self.slot.__set__(record, value)
+        record._converted |= self.bit
+
+
+class Model:
+    """A record read from a table, with a slot for each column rather than
+    a dict. Columns are read as attributes, record.post_id, and indexing
+    by name, record["post_id"], still works like it does on asyncpg's
+    records."""
+
+    __slots__ = ("_converted",)
+    table = None
+    columns = ()
+    names = frozenset()
+
+    def __init__(self, *values):
+        for column, value in zip(self.columns, values):
+            column.slot.__set__(self, value)
+        self._converted = 0
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        return cls(*[mapping.get(column.name) for column in cls.columns])
+
+    def __getitem__(self, key):
+        if key not in self.names:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.names else default
+
+    def keys(self):
+        return [column.name for column in self.columns]
+
+    def values(self):
+        return [getattr(self, column.name) for column in self.columns]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def __repr__(self):
+        values = " ".join(f"{name}={value!r}" for name, value in self.items())
+        return f"<{type(self).__name__} {values}>"
+
+
+def model(table, fields):
+    """Derive a model class for a table with an 'id' column and 'fields'."""
+    fields = [SerialIdentifier()] + list(fields)
+    name = "".join(part.title() for part in table.split("_"))
+    cls = type(
+        name,
+        (Model,),
+        {"__slots__": tuple(f"_{field.name}" for field in fields), "table": table},
+    )
+    cls.columns = tuple(
+        Column(field, getattr(cls, f"_{field.name}"), 1 << n)
+        for n, field in enumerate(fields)
+    )
+    for column in cls.columns:
+        setattr(cls, column.name, column)
+    cls.names = frozenset(column.name for column in cls.columns)
+    return cls
+
+
+MODELS = {table: model(table, fields) for table, fields in TABLES.items()}
@@ -0,0 +1,144 @@
+from contextlib import asynccontextmanager
+
+
+class Batch:
+    """Jobs claimed from an outbox, locked by the transaction they were
+    claimed in until the batch is finished with."""
+
+    def __init__(self, outbox, conn, jobs):
+        self.outbox = outbox
+        self.conn = conn
+        self.jobs = list(jobs)
+
+    @property
+    def guild_id(self):
+        return self.jobs[0]["guild_id"]
+
+    async def complete(self):
+        """Mark the jobs delivered and add them to the delivery log."""
+        await self.conn.execute(
+            f"UPDATE {self.outbox.name} SET status = 'done', last_error = NULL "
+            "WHERE id = ANY($1::int[]);",
+            [job["id"] for job in self.jobs],
+        )
+        await self.conn.executemany(
+            f"INSERT INTO {self.outbox.log} (guild_id, post_id) VALUES ($1, $2) "
+            "ON CONFLICT DO NOTHING;",
+            [(job["guild_id"], job["post_id"]) for job in self.jobs],
+        )
+
+    async def fail(self, error):
+        """Schedule the jobs to be retried with exponential backoff, or give
+        up on them once they have run out of attempts."""
+        await self.conn.execute(
+            f"UPDATE {self.outbox.name} SET attempts = attempts + 1, "
+            "last_error = $2, "
+            "status = CASE WHEN attempts + 1 >= $3 THEN 'dead' ELSE 'pending' END, "
+            "available_at = now() AT TIME ZONE 'utc' "
+            "+ $4 * power(2, attempts) * interval '1 second' "
+            "WHERE id = ANY($1::int[]);",
+            [job["id"] for job in self.jobs],
+            str(error),
+            self.outbox.max_attempts,
+            self.outbox.backoff,
+        )
+
+
+class Outbox:
+    """A queue of deliveries kept in the database, so that jobs survive a
+    crash and any number of workers in any number of processes can take
+    jobs without taking the same one.
+
+    Jobs are claimed with SELECT ... FOR UPDATE inside a transaction which
+    stays open while the job is worked on, under a transaction level
+    advisory lock on the guild's ID so that each guild has at most one
+    batch in flight and its jobs go out in order. If the process dies the
+    transaction is rolled back and the job is claimable again, and a
+    finished job is marked done in the same transaction that records it in
+    the delivery log. Guild IDs are snowflakes, far above the small keys
+    used for other advisory locks."""
+
+    def __init__(self, database, name, log, max_attempts=5, backoff=30):
+        self.database = database
+        self.name = name
+        self.log = log
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    async def enqueue(self, jobs):
+        """Queue (guild_id, post_id) jobs, any already queued are skipped."""
+        async with self.database.connection() as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    f"INSERT INTO {self.name} (guild_id, post_id) VALUES ($1, $2) "
+                    "ON CONFLICT DO NOTHING;",
+                    [(job["guild_id"], job["post_id"]) for job in jobs],
+                )
+
+    @asynccontextmanager
+    async def claim(self, guild_ids, batch_size=None):
+        """Claim the oldest due jobs of whichever of 'guild_ids' has the
+        oldest due job and no batch in flight. The batch has no jobs if
+        there was nothing to claim.
+
+        'batch_size' is a coroutine function given the guild's ID which
+        returns how many jobs to claim together, one if it isn't given. If
+        the body raises, whatever it did in the database is rolled back and
+        the batch is failed before the error is passed on, so every failed
+        attempt counts towards the backoff."""
+        error = None
+        async with self.database.connection() as conn:
+            async with conn.transaction():
+                guilds = await conn.fetch(
+                    f"SELECT guild_id FROM {self.name} WHERE status = 'pending' "
+                    "AND available_at <= now() AT TIME ZONE 'utc' "
+                    "AND guild_id = ANY($1::bigint[]) "
+                    "GROUP BY guild_id ORDER BY MIN(id);",
+                    list(guild_ids),
+                )
+                jobs = []
+                for record in guilds:
+                    guild_id = record["guild_id"]
+                    if not await conn.fetchval(
+                        "SELECT pg_try_advisory_xact_lock($1);", guild_id
+                    ):
+                        continue
+                    limit = await batch_size(guild_id) if batch_size else 1
+                    jobs = await conn.fetch(
+                        f"SELECT * FROM {self.name} WHERE status = 'pending' "
+                        "AND available_at <= now() AT TIME ZONE 'utc' "
+                        "AND guild_id = $1 ORDER BY id LIMIT $2 FOR UPDATE;",
+                        guild_id,
+                        limit,
+                    )
+                    if jobs:
+                        break
+
+                batch = Batch(self, conn, jobs)
+                try:
+                    async with conn.transaction():
+                        yield batch
+                except Exception as e:
+                    if not batch.jobs:
+                        raise
+                    error = e
+                    await batch.fail(e)
+        if error is not None:
+            raise error
+
+    async def next_available(self, guild_ids):
+        """When the next pending job becomes due, or None if there are none."""
+        async with self.database.connection() as conn:
+            return await conn.fetchval(
+                f"SELECT MIN(available_at) FROM {self.name} "
+                "WHERE status = 'pending' AND guild_id = ANY($1::bigint[]);",
+                list(guild_ids),
+            )
+
+    async def counts(self):
+        """The number of jobs in each status."""
+        async with self.database.connection() as conn:
+            records = await conn.fetch(
+                f"SELECT status, COUNT(*) FROM {self.name} GROUP BY status;"
+            )
+        return {record["status"]: record["count"] for record in records}
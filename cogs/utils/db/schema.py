@@ -0,0 +1,179 @@
+from .fields import *
+
+
+def create_table(name, fields):
+    """Build the CREATE TABLE statement for a table with an 'id' column."""
+    fields = [SerialIdentifier()] + list(fields)
+    fields_sql = ", ".join([f'"{f.name}" {f.datatype}' for f in fields])
+    return f"CREATE TABLE IF NOT EXISTS {name} ({fields_sql});"
+
+
+# Each migration is a list of statements, applied in order inside a single
+# transaction. Never edit a migration once it has shipped, add a new one.
+MIGRATIONS = [
+    # 1: tables that used to be created by Database.connect and BaseCog.setup.
+    [
+        create_table(
+            "server_setting",
+            (BigInteger("guild_id"), Text("key"), Text("value")),
+        ),
+        create_table(
+            "demographics_roles",
+            (BigInteger("guild_id"), Varchar("post_id", 1000)),
+        ),
+    ],
+    # 2: posts scraped by whichever process is polling Moodle, so that every
+    # process can deliver them, and a unique delivery log so that two
+    # processes can't both post the same announcement to a guild.
+    [
+        create_table(
+            "moodle_post",
+            (
+                Varchar("post_id", 1000),
+                Text("forum"),
+                Text("title"),
+                Text("author"),
+                Text("avatar"),
+                Text("url"),
+                Timestamp("date"),
+                Timestamp("posted_at"),
+                Text("description"),
+                Timestamp("scraped_at", default="CURRENT_TIMESTAMP"),
+            ),
+        ),
+        "CREATE UNIQUE INDEX IF NOT EXISTS moodle_post_post_id "
+        "ON moodle_post (post_id);",
+        "DELETE FROM demographics_roles a USING demographics_roles b "
+        "WHERE a.id > b.id AND a.guild_id = b.guild_id AND a.post_id = b.post_id;",
+        "CREATE UNIQUE INDEX IF NOT EXISTS demographics_roles_guild_post "
+        "ON demographics_roles (guild_id, post_id);",
+    ],
+    # 3: full text search over the scraped posts, titles rank above authors
+    # and forums, which rank above the body.
+    [
+        "ALTER TABLE moodle_post ADD COLUMN IF NOT EXISTS search tsvector "
+        "GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', "
+        "coalesce(author, '') || ' ' || coalesce(forum, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'C')"
+        ") STORED;",
+        "CREATE INDEX IF NOT EXISTS moodle_post_search "
+        "ON moodle_post USING GIN (search);",
+        "CREATE INDEX IF NOT EXISTS moodle_post_date ON moodle_post (date);",
+    ],
+    # 4: an outbox of (guild, post) deliveries, so that a failed or
+    # interrupted send is retried rather than lost. Rows are kept once done
+    # so that the unique index stops a delivered post being queued again.
+    [
+        create_table(
+            "announcement_outbox",
+            (
+                BigInteger("guild_id"),
+                Varchar("post_id", 1000),
+                Text("status", default="'pending'"),
+                Integer("attempts", default="0"),
+                Timestamp("available_at", default="(now() AT TIME ZONE 'utc')"),
+                Text("last_error"),
+                Timestamp("created_at", default="(now() AT TIME ZONE 'utc')"),
+            ),
+        ),
+        "CREATE UNIQUE INDEX IF NOT EXISTS announcement_outbox_guild_post "
+        "ON announcement_outbox (guild_id, post_id);",
+        "CREATE INDEX IF NOT EXISTS announcement_outbox_due "
+        "ON announcement_outbox (available_at) WHERE status = 'pending';",
+        # Posts already delivered before the outbox existed.
+        "INSERT INTO announcement_outbox (guild_id, post_id, status) "
+        "SELECT guild_id, post_id, 'done' FROM demographics_roles "
+        "ON CONFLICT DO NOTHING;",
+    ],
+    # 5: events synced from the Moodle calendar, and a log of the deadline
+    # reminders sent to each guild. The log is keyed on the due time too,
+    # so a deadline that moves is reminded about again.
+    [
+        create_table(
+            "moodle_event",
+            (
+                Varchar("uid", 255),
+                Text("summary"),
+                Text("description"),
+                Text("course"),
+                Timestamp("due_at"),
+                Timestamp("synced_at", default="(now() AT TIME ZONE 'utc')"),
+            ),
+        ),
+        "CREATE UNIQUE INDEX IF NOT EXISTS moodle_event_uid ON moodle_event (uid);",
+        "CREATE INDEX IF NOT EXISTS moodle_event_due_at ON moodle_event (due_at);",
+        create_table(
+            "event_reminder",
+            (
+                BigInteger("guild_id"),
+                Varchar("uid", 255),
+                Text("reminder"),
+                Timestamp("due_at"),
+            ),
+        ),
+        "CREATE UNIQUE INDEX IF NOT EXISTS event_reminder_guild_uid "
+        "ON event_reminder (guild_id, uid, reminder, due_at);",
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# The type of each guild setting, settings not listed here are strings.
+SETTINGS = {
+    "admin_role": BigInteger("admin_role"),
+    "mod_role": BigInteger("mod_role"),
+    "announcement_channel": BigInteger("announcement_channel"),
+    "announcement_digest": Boolean("announcement_digest"),
+}
+
+# The columns records are read into for each table, as they are after every
+# migration has run. A migration which adds a column has to add it here too,
+# or to UNFETCHED_COLUMNS if DBQuery should never fetch it. Database checks
+# both against the database at startup.
+TABLES = {
+    "server_setting": (
+        BigInteger("guild_id"),
+        Text("key"),
+        Setting("value", by="key", types=SETTINGS),
+    ),
+    "demographics_roles": (BigInteger("guild_id"), Varchar("post_id", 1000)),
+    "moodle_post": (
+        Varchar("post_id", 1000),
+        Text("forum"),
+        Text("title"),
+        Text("author"),
+        Text("avatar"),
+        Text("url"),
+        Timestamp("date"),
+        Timestamp("posted_at"),
+        Text("description"),
+        Timestamp("scraped_at"),
+    ),
+    "announcement_outbox": (
+        BigInteger("guild_id"),
+        Varchar("post_id", 1000),
+        Text("status"),
+        Integer("attempts"),
+        Timestamp("available_at"),
+        Text("last_error"),
+        Timestamp("created_at"),
+    ),
+    "moodle_event": (
+        Varchar("uid", 255),
+        Text("summary"),
+        Text("description"),
+        Text("course"),
+        Timestamp("due_at"),
+        Timestamp("synced_at"),
+    ),
+    "event_reminder": (
+        BigInteger("guild_id"),
+        Varchar("uid", 255),
+        Text("reminder"),
+        Timestamp("due_at"),
+    ),
+}
+
+UNFETCHED_COLUMNS = {"moodle_post": ("search",)}
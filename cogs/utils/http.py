@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+class RequestFailed(Exception):
+    """A request kept failing with a server error or timeout."""
+
+
+class CircuitOpen(RequestFailed):
+    """A request was not attempted because its host is failing."""
+
+
+class HostPolicy:
+    """How hard a single host may be hit.
+
+    'rate' requests per second are allowed on average with bursts of up to
+    'burst', and no more than 'concurrency' at once. Failed GETs are retried
+    'retries' times, and after 'failure_threshold' failures in a row the
+    host is skipped for 'cooldown' seconds."""
+
+    def __init__(
+        self,
+        rate=2.0,
+        burst=5,
+        concurrency=4,
+        timeout=30.0,
+        retries=3,
+        backoff=0.5,
+        max_backoff=10.0,
+        failure_threshold=5,
+        cooldown=60.0,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def take(self):
+        """Wait for a token, returns how long that took."""
+        start = time.monotonic()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - start
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Opens after 'threshold' failures in a row. Once 'cooldown' seconds
+    have passed a single trial request is let through, which closes it
+    again if it succeeds."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self):
+        self.failures += 1
+        if self.trial or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self.trial = False
+
+    def abandon(self):
+        """Give up on a request without an outcome, such as one that was
+        cancelled, so that another trial can be let through."""
+        self.trial = False
+
+
+class Host:
+    def __init__(self, name, policy):
+        self.name = name
+        self.policy = policy
+        self.bucket = TokenBucket(policy.rate, policy.burst)
+        self.semaphore = asyncio.Semaphore(policy.concurrency)
+        self.breaker = CircuitBreaker(policy.failure_threshold, policy.cooldown)
+
+
+class Response:
+    def __init__(self, status, text, url):
+        self.status = status
+        self.text = text
+        self.url = url
+
+
+class Stream:
+    """A response whose body is read a chunk at a time, so that reading can
+    stop part way through."""
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.status = resp.status
+        self.headers = resp.headers
+        self.url = str(resp.url)
+        self.bytes_read = 0
+
+    async def read(self):
+        """The next chunk of the body, b"" once it has all been read."""
+        chunk = await self.resp.content.readany()
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+class PoliteClient:
+    """An aiohttp session shared by everything that scrapes other sites,
+    which rate limits, retries and circuit breaks each host separately."""
+
+    retry_methods = ("GET", "HEAD")
+
+    def __init__(self, metrics, default_policy=None):
+        self.default_policy = default_policy or HostPolicy()
+        self.policies = {}
+        self.hosts = {}
+        self.session = None
+        self.logger = logging.getLogger(__name__)
+        self.request_counter = metrics.counter(
+            "http_requests_total",
+            "Outbound HTTP requests by host and outcome.",
+            ("host", "outcome"),
+        )
+        self.throttle_counter = metrics.counter(
+            "http_throttled_seconds_total",
+            "Time spent waiting on the rate limit for each host.",
+            ("host",),
+        )
+        self.received_counter = metrics.counter(
+            "http_received_bytes_total",
+            "Response body bytes read from each host.",
+            ("host",),
+        )
+
+    def configure(self, url, policy):
+        """Set the policy for the host of 'url'."""
+        name = urlsplit(url).netloc
+        self.policies[name] = policy
+        self.hosts.pop(name, None)
+
+    def host(self, url):
+        name = urlsplit(url).netloc
+        if name not in self.hosts:
+            policy = self.policies.get(name, self.default_policy)
+            self.hosts[name] = Host(name, policy)
+        return self.hosts[name]
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def request(self, method, url, **kwargs):
+        """Make a request and read its body. Raises RequestFailed if the host
+        keeps failing and CircuitOpen if it has been failing recently."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+
+        host = self.host(url)
+        policy = host.policy
+        attempts = policy.retries + 1 if method in self.retry_methods else 1
+
+        for attempt in range(attempts):
+            if not host.breaker.allow():
+                self.request_counter.inc(host=host.name, outcome="rejected")
+                raise CircuitOpen(f"{host.name} is failing, skipping {url}")
+
+            try:
+                waited = await host.bucket.take()
+                self.throttle_counter.inc(waited, host=host.name)
+                async with host.semaphore:
+                    async with self.session.request(
+                        method,
+                        url,
+                        timeout=aiohttp.ClientTimeout(total=policy.timeout),
+                        **kwargs,
+                    ) as resp:
+                        text = await resp.text()
+                        status = resp.status
+                        resp_url = str(resp.url)
+                        self.received_counter.inc(
+                            resp.content.total_bytes, host=host.name
+                        )
+                error = f"HTTP {status}" if status >= 500 else None
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                error = repr(e)
+            except asyncio.CancelledError:
+                host.breaker.abandon()
+                raise
+            except Exception:
+                # Anything unexpected still has to resolve a trial request,
+                # or the host would stay half-open for good.
+                host.breaker.failure()
+                self.request_counter.inc(host=host.name, outcome="failed")
+                raise
+
+            if error is None:
+                host.breaker.success()
+                self.request_counter.inc(host=host.name, outcome="ok")
+                return Response(status, text, resp_url)
+
+            host.breaker.failure()
+            if attempt + 1 < attempts:
+                self.request_counter.inc(host=host.name, outcome="retry")
+                delay = min(policy.max_backoff, policy.backoff * 2**attempt)
+                await asyncio.sleep(random.uniform(0, delay))
+
+        self.request_counter.inc(host=host.name, outcome="failed")
+        self.logger.warning(f"{method} {url} failed: {error}")
+        raise RequestFailed(f"{method} {url} failed: {error}")
+
+    @asynccontextmanager
+    async def stream(self, url, **kwargs):
+        """GET 'url' and yield a Stream to read the body from. It goes through
+        the same rate limit and circuit breaker as request() but isn't
+        retried, as part of the body may already have been used."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+
+        host = self.host(url)
+        if not host.breaker.allow():
+            self.request_counter.inc(host=host.name, outcome="rejected")
+            raise CircuitOpen(f"{host.name} is failing, skipping {url}")
+
+        stream = None
+        outcome = "failed"
+        try:
+            waited = await host.bucket.take()
+            self.throttle_counter.inc(waited, host=host.name)
+            async with host.semaphore:
+                async with self.session.get(
+                    url,
+                    timeout=aiohttp.ClientTimeout(total=host.policy.timeout),
+                    **kwargs,
+                ) as resp:
+                    if resp.status >= 500:
+                        raise RequestFailed(f"GET {url} failed: HTTP {resp.status}")
+                    stream = Stream(resp)
+                    try:
+                        yield stream
+                    except (asyncio.TimeoutError, aiohttp.ClientError):
+                        raise
+                    except Exception:
+                        # The host answered and the caller rejected what it
+                        # sent, a bad status or a body that won't parse, which
+                        # doesn't mean the host is down.
+                        outcome = "ok"
+                        raise
+                    outcome = "ok"
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            raise RequestFailed(f"GET {url} failed: {e!r}") from e
+        except asyncio.CancelledError:
+            outcome = None
+            raise
+        finally:
+            if stream is not None:
+                self.received_counter.inc(stream.bytes_read, host=host.name)
+            if outcome == "ok":
+                host.breaker.success()
+            elif outcome == "failed":
+                host.breaker.failure()
+            else:
+                host.breaker.abandon()
+            if outcome is not None:
+                self.request_counter.inc(host=host.name, outcome=outcome)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
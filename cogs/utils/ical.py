@@ -0,0 +1,58 @@
+import datetime
+import re
+
+
+def unfold(text):
+    """Join iCalendar content lines that were folded onto several lines."""
+    return re.sub(r"\r?\n[ \t]", "", text).splitlines()
+
+
+def unescape(value):
+    return re.sub(
+        r"\\([\\;,nN])",
+        lambda m: "\n" if m.group(1) in "nN" else m.group(1),
+        value,
+    )
+
+
+def parse_datetime(value, params):
+    """Parse a DTSTART/DTEND style value to a naive UTC datetime."""
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.datetime.strptime(value[:8], "%Y%m%d")
+    if value.endswith("Z"):
+        return datetime.datetime.strptime(value, "%Y%m%dT%H%M%SZ")
+
+    parsed = datetime.datetime.strptime(value, "%Y%m%dT%H%M%S")
+    if "TZID" in params:
+        from dateutil import tz
+
+        zone = tz.gettz(params["TZID"])
+        if zone is not None:
+            parsed = parsed.replace(tzinfo=zone).astimezone(datetime.timezone.utc)
+            return parsed.replace(tzinfo=None)
+    return parsed
+
+
+def parse_events(text):
+    """Parse the VEVENTs in an iCalendar file into dicts of their properties,
+    with DTSTART and DTEND as naive UTC datetimes and text unescaped."""
+    events = []
+    event = None
+    for line in unfold(text):
+        name, _, value = line.partition(":")
+        name, *param_list = name.split(";")
+        name = name.upper()
+        params = dict(p.partition("=")[::2] for p in param_list)
+
+        if name == "BEGIN" and value.upper() == "VEVENT":
+            event = {}
+        elif name == "END" and value.upper() == "VEVENT":
+            if event is not None and "UID" in event:
+                events.append(event)
+            event = None
+        elif event is not None:
+            if name in ("DTSTART", "DTEND"):
+                event[name] = parse_datetime(value, params)
+            else:
+                event[name] = unescape(value)
+    return events
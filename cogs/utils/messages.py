@@ -34,6 +34,20 @@ class MessageBox(discord.Embed):
         return embed
 
 
+async def send_embeds(channel, embeds):
+    """Send up to 10 embeds in a single message. discord.py 1.x can only send
+    one embed per message, so this goes through the HTTP client directly."""
+    if len(embeds) == 1:
+        return await channel.send(embed=embeds[0])
+    route = discord.http.Route(
+        "POST", "/channels/{channel_id}/messages", channel_id=channel.id
+    )
+    data = await channel._state.http.request(
+        route, json={"embeds": [embed.to_dict() for embed in embeds]}
+    )
+    return channel._state.create_message(channel=channel, data=data)
+
+
 class Duration(commands.Converter):
     async def convert(self, ctx, argument):
         """Converts a string like 1w2d into a datetime."""
@@ -82,3 +96,49 @@ class EveryoneRole(commands.Converter):
         raise commands.errors.BadArgument(
             "Specify the everyone role by typing the word `everyone`"
         )
+
+
+class SearchQuery(commands.Converter):
+    async def convert(self, ctx, argument):
+        """Splits 'forum:', 'after:' and 'before:' filters from search terms."""
+        query = {"terms": [], "forum": None, "after": None, "before": None}
+
+        for word in str(argument).split():
+            key, _, value = word.partition(":")
+            key = key.lower()
+            if key == "forum" and value:
+                query["forum"] = value
+            elif key in ("after", "before") and value:
+                try:
+                    query[key] = datetime.datetime.strptime(value, "%Y-%m-%d")
+                except ValueError:
+                    raise commands.errors.BadArgument(
+                        f"`{key}:` dates must be in the format YYYY-MM-DD"
+                    )
+            else:
+                query["terms"].append(word)
+
+        if not query["terms"]:
+            raise commands.errors.BadArgument("Enter something to search for.")
+        query["terms"] = " ".join(query["terms"])
+        return query
+
+
+class LazyMember(commands.MemberConverter):
+    """Converts to a member like discord.Member does, but fetches members
+    that aren't cached over HTTP rather than asking the gateway, which
+    needs the members intent. Without the intent, uncached members can
+    only be found by mention or ID."""
+
+    async def query_member_by_id(self, bot, guild, user_id):
+        try:
+            return await guild.fetch_member(user_id)
+        except discord.HTTPException:
+            return None
+
+    async def query_member_named(self, guild, argument):
+        if guild._state._intents.members:
+            return await super().query_member_named(guild, argument)
+        raise commands.errors.BadArgument(
+            f"I can't look up `{argument}` by name, mention them or use their ID."
+        )
@@ -0,0 +1,163 @@
+import bisect
+import contextvars
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, like a Prometheus histogram."""
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        if key not in self.series:
+            self.series[key] = {
+                "counts": [0] * (len(self.buckets) + 1),
+                "sum": 0.0,
+                "count": 0,
+            }
+        series = self.series[key]
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def quantile(self, q, series):
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        target = q * series["count"]
+        seen = 0
+        for bound, count in zip(self.buckets, series["counts"]):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        """Yields (labels, count, mean, p50, p95) for every series."""
+        for key, series in sorted(self.series.items()):
+            yield (
+                dict(zip(self.labels, key)),
+                series["count"],
+                series["sum"] / series["count"],
+                self.quantile(0.5, series),
+                self.quantile(0.95, series),
+            )
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, series in sorted(self.series.items()):
+            labels = [f'{k}="{escape(v)}"' for k, v in zip(self.labels, key)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series["counts"]):
+                cumulative += count
+                le = ",".join(labels + [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{le}}} {cumulative}")
+            label_text = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{self.name}_sum{label_text} {series['sum']}")
+            lines.append(f"{self.name}_count{label_text} {series['count']}")
+        return "\n".join(lines)
+
+
+class Counter:
+    """A total that only goes up, like a Prometheus counter."""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.series = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def summary(self):
+        """Yields (labels, value) for every series."""
+        for key, value in sorted(self.series.items()):
+            yield dict(zip(self.labels, key)), value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for key, value in sorted(self.series.items()):
+            labels = ",".join([f'{k}="{escape(v)}"' for k, v in zip(self.labels, key)])
+            lines.append(
+                f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}"
+            )
+        return "\n".join(lines)
+
+
+class Registry:
+    """Holds every metric the bot records, in memory."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def histogram(self, name, documentation, labels=(), **kwargs):
+        """Get a histogram, creating it the first time it's asked for so that
+        reloaded cogs keep adding to the same one."""
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, documentation, labels, **kwargs)
+        return self.metrics[name]
+
+    def counter(self, name, documentation, labels=()):
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, documentation, labels)
+        return self.metrics[name]
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        return "\n".join([m.render() for m in self.metrics.values()]) + "\n"
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_stages = contextvars.ContextVar("stages", default=None)
+
+
+@contextmanager
+def collect_stages():
+    """Collect the total time spent in each stage() within this block."""
+    timings = defaultdict(float)
+    token = _stages.set(timings)
+    try:
+        yield timings
+    finally:
+        _stages.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of a task, this does nothing outside collect_stages()."""
+    timings = _stages.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] += time.perf_counter() - start
@@ -0,0 +1,113 @@
+import asyncio
+import cProfile
+import io
+import pstats
+import time
+
+try:
+    import yappi
+except ImportError:
+    yappi = None
+
+
+class ProfilerBusy(Exception):
+    """Only one profile can run at a time."""
+
+
+class Profiler:
+    """Profiles everything the event loop runs while it is active, so any
+    other tasks running at the same time show up too.
+
+    yappi follows coroutines across awaits and reports wall time, so time
+    spent waiting on Moodle or Discord shows up against the function that
+    waited. cProfile, which only counts time between awaits, is only used
+    where yappi hasn't been installed from the Pipfile."""
+
+    running = False
+
+    def __init__(self):
+        self.backend = "yappi" if yappi is not None else "cProfile"
+        self.profile = None
+        self.started = None
+        self.elapsed = None
+
+    def start(self):
+        if Profiler.running:
+            raise ProfilerBusy("Something else is already being profiled.")
+        Profiler.running = True
+        self.started = time.perf_counter()
+        if yappi is not None:
+            yappi.clear_stats()
+            yappi.set_clock_type("wall")
+            yappi.start(profile_threads=False)
+        else:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self):
+        if yappi is not None:
+            yappi.stop()
+        else:
+            self.profile.disable()
+        self.elapsed = time.perf_counter() - self.started
+        Profiler.running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def report(self, limit=50):
+        """The top 'limit' functions by cumulative time, as text."""
+        out = io.StringIO()
+        out.write(f"{self.backend}, {self.elapsed:.3f}s wall time\n\n")
+        if yappi is not None:
+            stats = yappi.get_func_stats().sort("ttot", "desc")
+            out.write(f"{'ncalls':>8}  {'tottime':>9}  {'cumtime':>9}  function\n")
+            for stat in list(stats)[:limit]:
+                out.write(
+                    f"{stat.ncall:>8}  {stat.tsub:>9.3f}  {stat.ttot:>9.3f}  "
+                    f"{stat.full_name}\n"
+                )
+            yappi.clear_stats()
+        else:
+            stats = pstats.Stats(self.profile, stream=out)
+            stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+def profile_next_run(task):
+    """Profile the next run of a tasks.loop task, returns a future which is
+    set to the Profiler once that run has finished. Cancelling the future
+    before the run starts leaves the task as it was."""
+    if getattr(task.coro, "profiled", False):
+        raise ProfilerBusy("The next run is already being profiled.")
+    future = asyncio.get_event_loop().create_future()
+    coro = task.coro
+
+    async def profiled(*args, **kwargs):
+        task.coro = coro
+        profiler = Profiler()
+        try:
+            profiler.start()
+        except ProfilerBusy as e:
+            future.set_exception(e)
+            return await coro(*args, **kwargs)
+        try:
+            return await coro(*args, **kwargs)
+        finally:
+            profiler.stop()
+            if not future.done():
+                future.set_result(profiler)
+
+    def restore(future):
+        if future.cancelled() and task.coro is profiled:
+            task.coro = coro
+
+    profiled.__name__ = coro.__name__
+    profiled.profiled = True
+    task.coro = profiled
+    future.add_done_callback(restore)
+    return future
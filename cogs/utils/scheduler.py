@@ -0,0 +1,81 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+
+
+class Scheduler:
+    """Calls 'callback(key, payload)' when each scheduled entry falls due.
+
+    Entries are kept in a min-heap by due time and a single task sleeps
+    until the earliest one, waking early if something sooner is scheduled.
+    Scheduling an existing key replaces it and cancelling removes it, the
+    old heap entry is marked dead and skipped when it reaches the top,
+    and the heap is rebuilt once more than half of it is dead. Times are
+    naive UTC datetimes."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.changed = asyncio.Event()
+        self.task = None
+        self.logger = logging.getLogger(__name__)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def schedule(self, key, when, payload=None):
+        self.cancel(key)
+        # The counter breaks ties, so keys and payloads are never compared.
+        entry = [when, next(self.counter), key, payload, True]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self.changed.set()
+
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry[-1] = False
+            if len(self.heap) > 2 * len(self.entries) + 16:
+                self.heap = [e for e in self.heap if e[-1]]
+                heapq.heapify(self.heap)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_event_loop().create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            while self.heap and not self.heap[0][-1]:
+                heapq.heappop(self.heap)
+
+            self.changed.clear()
+            if not self.heap:
+                await self.changed.wait()
+                continue
+
+            delay = (self.heap[0][0] - datetime.datetime.utcnow()).total_seconds()
+            if delay > 0:
+                # Sleep at most an hour at a time, so a change to the system
+                # clock can't throw a reminder out by days.
+                try:
+                    await asyncio.wait_for(self.changed.wait(), min(delay, 3600))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            when, _, key, payload, _ = heapq.heappop(self.heap)
+            del self.entries[key]
+            try:
+                await self.callback(key, payload)
+            except Exception:
+                self.logger.exception(f"Scheduled callback for {key!r} failed.")
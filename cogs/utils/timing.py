@@ -0,0 +1,26 @@
+import time
+
+
+class PhaseTimer:
+    """Records how long each named phase of a process takes."""
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.last = self.start
+        self.phases = {}
+
+    def mark(self, phase):
+        """End the current phase, naming it 'phase'."""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self.last
+        self.last = now
+
+    @property
+    def total(self):
+        return self.last - self.start
+
+    def summary(self):
+        phases = ", ".join(
+            [f"{name} {seconds:.2f}s" for name, seconds in self.phases.items()]
+        )
+        return f"{self.total:.2f}s ({phases})"
@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+import logging
+import sys
+import threading
+import time
+import traceback
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from sleeps, and when it
+    stalls for longer than 'threshold' seconds logs the stack of the
+    blocking code from a helper thread."""
+
+    def __init__(self, interval=0.25, threshold=0.5, histogram=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.histogram = histogram
+        self.logger = logging.getLogger(__name__)
+
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_stall = None
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def mean_lag(self):
+        return self.total_lag / self.samples if self.samples else 0.0
+
+    def start(self, loop):
+        """Start monitoring, this must be called from the loop's thread."""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = loop.create_task(self._measure())
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-lag-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _measure(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = now = time.monotonic()
+            lag = max(now - start - self.interval, 0.0)
+
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            if self.histogram is not None:
+                self.histogram.observe(lag)
+
+    def _watch(self):
+        # Runs in its own thread, so it keeps going while the loop is blocked.
+        reported = None
+        while not self._stopping.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked > self.threshold and reported != heartbeat:
+                # Only report each stall once, at the point it crosses the threshold.
+                reported = heartbeat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else ""
+                self.stalls += 1
+                self.last_stall = {
+                    "when": datetime.datetime.now(),
+                    "blocked": blocked,
+                    "stack": stack,
+                }
+                self.logger.warning(
+                    f"Event loop blocked for over {blocked:.2f}s in:\n{stack}"
+                )
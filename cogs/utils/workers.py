@@ -0,0 +1,56 @@
+import asyncio
+import logging
+
+
+class WorkerPool:
+    """Runs up to 'size' copies of 'work' at once while there is work to do.
+
+    'work' is a coroutine function which does one job and returns whether it
+    found one. Workers are started by wake() and stop by themselves once
+    'work' runs out, so the pool grows with a backlog and is empty when
+    idle. 'idle' is awaited whenever the last worker stops."""
+
+    def __init__(self, work, size=4, idle=None):
+        self.work = work
+        self.size = size
+        self.idle = idle
+        self.workers = set()
+        self.logger = logging.getLogger(__name__)
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    def wake(self, n=None):
+        """Start up to 'n' more workers, as many as the pool allows by default."""
+        n = self.size if n is None else n
+        while n > 0 and len(self.workers) < self.size:
+            task = asyncio.get_event_loop().create_task(self._worker())
+            self.workers.add(task)
+            self._drained.clear()
+            n -= 1
+
+    async def _worker(self):
+        try:
+            while True:
+                try:
+                    if not await self.work():
+                        break
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.logger.exception("Worker failed.")
+                    break
+        finally:
+            self.workers.discard(asyncio.current_task())
+            if not self.workers:
+                self._drained.set()
+                if self.idle is not None:
+                    asyncio.get_event_loop().create_task(self.idle())
+
+    async def join(self):
+        """Wait until every worker has stopped."""
+        await self._drained.wait()
+
+    def cancel(self):
+        self.idle = None
+        for task in list(self.workers):
+            task.cancel()